@@ -12,22 +12,72 @@ ALPTECH AI Stüdyo — v3.0
 
 from __future__ import annotations
 
+import atexit
 import base64
+import csv
+import functools
+import hashlib
+import http.server
+import json
+import os
+import random
 import re
+import sqlite3
+import tempfile
+import threading
+import time
 import traceback
+import tracemalloc
+import uuid
+import zipfile
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
 from io import BytesIO
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
 from zoneinfo import ZoneInfo
 
+import numpy as np
 import requests
 import streamlit as st
-from openai import OpenAI
+import streamlit.components.v1 as components
 from PIL import Image, ImageOps, ImageFilter
-from rembg import remove
+from requests.adapters import HTTPAdapter
+
+if TYPE_CHECKING:
+    # openai ve rembg (onnxruntime + matting yığını) ilk kullanımda yüklenir;
+    # bkz. get_openai_client / rembg_modulu.
+    from openai import OpenAI
+
+try:
+    import tiktoken  # isteğe bağlı: yoksa token sayısı kaba tahminle bulunur
+except ImportError:
+    tiktoken = None
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+try:
+    import resource  # yalnızca Unix: süreç RSS tepe değeri için
+except ImportError:
+    resource = None
+
+_RERUN_BASLANGIC = time.perf_counter()  # rerun profili: betiğin başladığı an
 
 # ===========================
 # GÜVENLİ AYARLAR & KONFIG
 # ===========================
+def secret_listesi(ad: str, varsayilan: list[str]) -> list[str]:
+    """Liste ayarı: TOML dizisi ya da virgülle ayrılmış metin; boş öğeler atılır."""
+    deger = st.secrets.get(ad, varsayilan)
+    if isinstance(deger, str):
+        deger = deger.split(",")
+    return [str(d).strip() for d in deger if str(d).strip()]
+
+
 if "OPENAI_API_KEY" in st.secrets:
     SABIT_API_KEY = st.secrets["OPENAI_API_KEY"]
 else:
@@ -43,9 +93,88 @@ WEATHER_API_KEY = st.secrets.get(
     "WEATHER_API_KEY", "5f9ee20a060a62ba9cb79d4a048395d9"
 )
 WEATHER_DEFAULT_CITY = st.secrets.get("WEATHER_DEFAULT_CITY", "İstanbul")
+WEATHER_PREFETCH_TOP = int(st.secrets.get("WEATHER_PREFETCH_TOP", 10))
+WEATHER_PREFETCH_INTERVAL = int(st.secrets.get("WEATHER_PREFETCH_INTERVAL", 300))  # sn
+WEATHER_PREFETCH_CALLS_PER_HOUR = int(st.secrets.get("WEATHER_PREFETCH_CALLS_PER_HOUR", 300))
+WEATHER_MAX_AGE = {"current": 600, "forecast": 3600}  # önbellek ömrü (sn)
+WEATHER_CACHE_PATH = st.secrets.get("WEATHER_CACHE_PATH", ".cache/weather_cache.json")
+
+# Dış HTTP çağrıları (havuzlu istemci)
+HTTP_TIMEOUT = float(st.secrets.get("HTTP_TIMEOUT", 10))
+HTTP_RETRIES = int(st.secrets.get("HTTP_RETRIES", 2))
+HTTP_POOL_SIZE = int(st.secrets.get("HTTP_POOL_SIZE", 16))
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+CHAT_TURN_BUDGET = float(st.secrets.get("CHAT_TURN_BUDGET", 60))  # sn, tur başına
+CLOCK_RESYNC_SECONDS = int(st.secrets.get("CLOCK_RESYNC_SECONDS", 3600))
+
+# Sohbet bağlamı (token bütçesi ve eski turların özeti)
+CHAT_CONTEXT_TOKENS = int(st.secrets.get("CHAT_CONTEXT_TOKENS", 6000))
+CHAT_SUMMARY_TOKENS = int(st.secrets.get("CHAT_SUMMARY_TOKENS", 400))
+CHAT_DB_PATH = st.secrets.get("CHAT_DB_PATH", ".cache/sohbet.db")
+CHAT_PAGE_SIZE = int(st.secrets.get("CHAT_PAGE_SIZE", 50))  # belleğe alınan mesaj sayfası
+CHAT_WINDOW = int(st.secrets.get("CHAT_WINDOW", 30))  # ekranda çizilen son mesaj sayısı
+CHAT_USER_COOKIE = "alptech_kullanici"
+# Birebir aynı sohbet istekleri için disk önbelleği
+LLM_CACHE_PATH = st.secrets.get("LLM_CACHE_PATH", ".cache/llm_cache.db")
+LLM_CACHE_TTL = int(st.secrets.get("LLM_CACHE_TTL", 7 * 24 * 3600))  # sn
+LLM_CACHE_MB = int(st.secrets.get("LLM_CACHE_MB", 64))
+CHAT_IMAGE_DETAILS = {
+    "auto": "Otomatik",
+    "low": "Düşük (512 px, hızlı)",
+    "high": "Yüksek (ayrıntılı)",
+}
+CHAT_IMAGE_DETAIL = str(st.secrets.get("CHAT_IMAGE_DETAIL", "auto")).strip().lower()
+if CHAT_IMAGE_DETAIL not in CHAT_IMAGE_DETAILS:
+    print(f"geçersiz CHAT_IMAGE_DETAIL {CHAT_IMAGE_DETAIL!r}; 'auto' kullanılıyor")
+    CHAT_IMAGE_DETAIL = "auto"
+# Sohbete eklenen PDF/TXT belgeleri (yerel BM25 arama)
+DOC_CHUNK_WORDS = int(st.secrets.get("DOC_CHUNK_WORDS", 180))
+DOC_TOP_K = int(st.secrets.get("DOC_TOP_K", 4))
+CHAT_DOC_TOKENS = int(st.secrets.get("CHAT_DOC_TOKENS", 1500))
+
+# Arka plan kaldırma (rembg / ONNX Runtime)
+REMBG_MODEL = st.secrets.get("REMBG_MODEL", "u2net")
+REMBG_PROVIDERS = secret_listesi("REMBG_PROVIDERS", ["CPUExecutionProvider"])
+REMBG_THREADS = int(st.secrets.get("REMBG_THREADS", 0))  # 0 = ONNX varsayılanı
+MATTING_FG_THRESHOLD = 240
+MATTING_BG_THRESHOLD = 10
+MATTING_ERODE_SIZE = 10  # rembg varsayılanı
+MATTE_CACHE_MB = int(st.secrets.get("MATTE_CACHE_MB", 256))
+# Üretilmiş AI sahneleri (içerik adresli disk önbelleği)
+SCENE_SIZE = "1024x1024"
+SCENE_CACHE_DIR = st.secrets.get("SCENE_CACHE_DIR", ".cache/scenes")
+SCENE_CACHE_MB = int(st.secrets.get("SCENE_CACHE_MB", 512))
+MATTE_TIERS = {
+    "draft": "⚡ Taslak (ham maske)",
+    "fast": "🚀 Hızlı (kenar iyileştirme)",
+    "best": "💎 En İyi (alpha matting)",
+}
+MATTE_DEFAULT_TIER = st.secrets.get("MATTE_DEFAULT_TIER", "best")
+STUDIO_WARMUP = bool(st.secrets.get("STUDIO_WARMUP", True))  # açılışta modeli arka planda ısıt
+FAST_MATTE_SIDE = int(st.secrets.get("FAST_MATTE_SIDE", 384))
+FAST_MATTE_RADIUS = 4  # küçültülmüş görüntüde piksel
+FAST_MATTE_EPS = 1e-3
+
+# İçerik filtresi: BAD_TERMS'e eklenecek ek terimler (aynı "*" ek kuralıyla).
+# Tek harflik terimler neredeyse her mesajı engelleyeceği için atılır.
+MODERATION_EXTRA_TERMS = [
+    t for t in secret_listesi("MODERATION_EXTRA_TERMS", []) if len(t.rstrip("*").strip()) > 1
+]
+
+# Aşama izleri: JSON satır günlüğü ("-" = stdout, "" = kapalı) ve Prometheus uç noktası
+TRACE_LOG_PATH = st.secrets.get("TRACE_LOG_PATH", ".cache/izler.jsonl")
+TRACE_LOG_MB = int(st.secrets.get("TRACE_LOG_MB", 32))  # aşılınca .1 dosyasına döner
+TRACE_MEMORY = bool(st.secrets.get("TRACE_MEMORY", False))  # tracemalloc tepe belleği; yavaş
+METRICS_HOST = st.secrets.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(st.secrets.get("METRICS_PORT", 9108))  # 0 = kapalı
+
+# Yönetim araçları (benchmark vb.) yalnızca bu bayrak açıkken görünür
+ADMIN_TOOLS = bool(st.secrets.get("ADMIN_TOOLS", False))
 
 # Logo dosya yolu (uygulama dizininde olmalı)
 LOGO_PATH = "ALPTECHAI.png"
+# Çevrimdışı il/ilçe koordinat dizini (uygulama dizininde olmalı)
+GAZETTEER_PATH = "tr_gazetteer.csv"
 
 st.set_page_config(
     page_title="ALPTECH AI Stüdyo",
@@ -247,17 +376,10 @@ if "sonuc_gorseli" not in st.session_state:
 if "sonuc_format" not in st.session_state:
     st.session_state.sonuc_format = "PNG"
 
-# Chat oturumları
-if "chat_sessions" not in st.session_state:
-    st.session_state.chat_sessions = {}
-if "current_session" not in st.session_state:
-    st.session_state.current_session = "Oturum 1"
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = [
-        {"role": "assistant", "content": "Merhaba! Hangi modu kullanmak istersin?"}
-    ]
-if "chat_sessions" in st.session_state and "Oturum 1" not in st.session_state.chat_sessions:
-    st.session_state.chat_sessions["Oturum 1"] = st.session_state.chat_history
+# Chat oturumları: konuşmalar SQLite deposunda; burada yalnızca aktif olanın
+# son mesaj sayfası tutulur (bkz. sohbet_oturumunu_hazirla).
+if "sohbet_ozetleri" not in st.session_state:
+    st.session_state.sohbet_ozetleri = {}
 
 if "chat_image" not in st.session_state:
     st.session_state.chat_image = None
@@ -288,6 +410,315 @@ def inc_stat(key: str, step: int = 1):
         st.session_state.analytics[key] = 0
     st.session_state.analytics[key] += step
 
+# ===========================
+# RERUN PROFİLİ
+# ===========================
+class RerunProfili:
+    """Süreç genelinde, bölüm başına son `pencere` rerun süresini tutar."""
+
+    def __init__(self, pencere: int = 200):
+        self.pencere = pencere
+        self._olcumler: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def kaydet(self, bolum: str, sure: float):
+        with self._lock:
+            self._olcumler.setdefault(bolum, deque(maxlen=self.pencere)).append(sure)
+
+    def sifirla(self):
+        with self._lock:
+            self._olcumler.clear()
+
+    def ozet(self) -> list[dict]:
+        with self._lock:
+            kopya = {b: list(o) for b, o in self._olcumler.items()}
+        satirlar = []
+        for bolum, olcumler in kopya.items():
+            ms = np.asarray(olcumler) * 1000
+            satirlar.append(
+                {
+                    "bölüm": bolum,
+                    "adet": len(ms),
+                    "son_ms": round(float(ms[-1]), 1),
+                    "ort_ms": round(float(ms.mean()), 1),
+                    "p95_ms": round(float(np.percentile(ms, 95)), 1),
+                }
+            )
+        return sorted(satirlar, key=lambda s: s["ort_ms"], reverse=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_rerun_profili() -> RerunProfili:
+    return RerunProfili()
+
+
+class RerunZamanlayici:
+    """Tam sayfa rerun'ını bölümlere ayırır: her isaret() öncekinden beri geçen süreyi yazar."""
+
+    def __init__(self, baslangic: float):
+        self.baslangic = baslangic
+        self.son = baslangic
+
+    def isaret(self, bolum: str):
+        simdi = time.perf_counter()
+        get_rerun_profili().kaydet(bolum, simdi - self.son)
+        self.son = simdi
+
+    def bitir(self):
+        get_rerun_profili().kaydet("= tam rerun", time.perf_counter() - self.baslangic)
+
+
+def profilli(bolum: str, fn):
+    """Fragment gövdesini sarar; fragment'ın kendi rerun'ları "⟳ bölüm" satırına yazılır."""
+
+    @functools.wraps(fn)
+    def sarili(*args, **kwargs):
+        baslangic = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            get_rerun_profili().kaydet(f"⟳ {bolum}", time.perf_counter() - baslangic)
+
+    return sarili
+
+
+# ===========================
+# AŞAMA İZLERİ & METRİKLER
+# ===========================
+# Prometheus histogram sınırları (sn): görsel aşamaları ms, AI çağrıları onlarca sn sürer.
+IZ_KOVALARI = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_AKTIF_IZ: ContextVar[dict | None] = ContextVar("alptech_aktif_iz", default=None)
+
+
+def rss_tepe_bayt() -> int | None:
+    """Sürecin şimdiye kadarki en yüksek RSS değeri (Linux'ta KB, macOS'ta bayt döner)."""
+    if resource is None:
+        return None
+    tepe = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return tepe if os.uname().sysname == "Darwin" else tepe * 1024
+
+
+_SAYFA_BAYT = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_simdi_bayt() -> int | None:
+    """Sürecin anlık RSS değeri (/proc/self/statm); desteklenmeyen platformda None."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _SAYFA_BAYT
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Izleyici:
+    """Aşama izlerini toplar: JSON satır günlüğü + aşama başına gecikme histogramı.
+
+    Arka plan iş parçacıklarından da çağrılır; st.* kullanmaz.
+    """
+
+    def __init__(self, gunluk_yolu: str, azami_bayt: int):
+        self.gunluk_yolu = gunluk_yolu
+        self.azami_bayt = azami_bayt
+        self._lock = threading.Lock()
+        self._kovalar: dict[str, list[int]] = {}
+        self._toplam: dict[str, float] = {}
+        self._adet: Counter = Counter()
+        self._hata: Counter = Counter()
+        self._bayt: Counter = Counter()  # (aşama, "in"/"out")
+        if gunluk_yolu and gunluk_yolu != "-":
+            os.makedirs(os.path.dirname(gunluk_yolu) or ".", exist_ok=True)
+        if TRACE_MEMORY and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def kaydet(self, iz: dict):
+        asama = iz["asama"]
+        sure = iz["sure_ms"] / 1000
+        with self._lock:
+            kovalar = self._kovalar.setdefault(asama, [0] * len(IZ_KOVALARI))
+            for i, sinir in enumerate(IZ_KOVALARI):
+                if sure <= sinir:
+                    kovalar[i] += 1
+            self._toplam[asama] = self._toplam.get(asama, 0.0) + sure
+            self._adet[asama] += 1
+            if iz.get("hata"):
+                self._hata[asama] += 1
+            for anahtar, yon in (("bayt_giris", "in"), ("bayt_cikis", "out")):
+                if iz.get(anahtar):
+                    self._bayt[(asama, yon)] += iz[anahtar]
+            self._gunluge_yaz(iz)
+
+    def _gunluge_yaz(self, iz: dict):
+        if not self.gunluk_yolu:
+            return
+        satir = json.dumps(iz, ensure_ascii=False, default=str)
+        if self.gunluk_yolu == "-":
+            print(satir, flush=True)
+            return
+        yol = self.gunluk_yolu
+        try:
+            if os.path.exists(yol) and os.path.getsize(yol) > self.azami_bayt:
+                os.replace(yol, yol + ".1")
+            with open(yol, "a", encoding="utf-8") as f:
+                f.write(satir + "\n")
+        except OSError as e:
+            print("İz günlüğü yazılamadı:", e)
+
+    def prometheus(self) -> str:
+        """Prometheus metin biçimi (exposition format 0.0.4)."""
+
+        def etiket(deger: str) -> str:
+            return deger.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        with self._lock:
+            kovalar = {a: list(k) for a, k in self._kovalar.items()}
+            toplam, adet = dict(self._toplam), dict(self._adet)
+            hata, bayt = dict(self._hata), dict(self._bayt)
+        satirlar = [
+            "# HELP alptech_stage_duration_seconds Pipeline stage latency.",
+            "# TYPE alptech_stage_duration_seconds histogram",
+        ]
+        for asama in sorted(kovalar):
+            a = etiket(asama)
+            for sinir, sayi in zip(IZ_KOVALARI, kovalar[asama]):
+                satirlar.append(
+                    f'alptech_stage_duration_seconds_bucket{{stage="{a}",le="{sinir}"}} {sayi}'
+                )
+            satirlar.append(
+                f'alptech_stage_duration_seconds_bucket{{stage="{a}",le="+Inf"}} {adet[asama]}'
+            )
+            satirlar.append(
+                f'alptech_stage_duration_seconds_sum{{stage="{a}"}} {toplam[asama]:.6f}'
+            )
+            satirlar.append(f'alptech_stage_duration_seconds_count{{stage="{a}"}} {adet[asama]}')
+        satirlar += [
+            "# HELP alptech_stage_errors_total Stage executions that raised.",
+            "# TYPE alptech_stage_errors_total counter",
+        ]
+        for asama in sorted(kovalar):
+            satirlar.append(
+                f'alptech_stage_errors_total{{stage="{etiket(asama)}"}} {hata.get(asama, 0)}'
+            )
+        satirlar += [
+            "# HELP alptech_stage_bytes_total Payload bytes consumed/produced by a stage.",
+            "# TYPE alptech_stage_bytes_total counter",
+        ]
+        for (asama, yon), deger in sorted(bayt.items()):
+            satirlar.append(
+                f'alptech_stage_bytes_total{{stage="{etiket(asama)}",direction="{yon}"}} {deger}'
+            )
+        rss = rss_tepe_bayt()
+        if rss is not None:
+            satirlar += [
+                "# HELP alptech_process_max_rss_bytes Peak resident set size of the process.",
+                "# TYPE alptech_process_max_rss_bytes gauge",
+                f"alptech_process_max_rss_bytes {rss}",
+            ]
+        rss = rss_simdi_bayt()
+        if rss is not None:
+            satirlar += [
+                "# HELP alptech_process_rss_bytes Current resident set size of the process.",
+                "# TYPE alptech_process_rss_bytes gauge",
+                f"alptech_process_rss_bytes {rss}",
+            ]
+        return "\n".join(satirlar) + "\n"
+
+
+@st.cache_resource(show_spinner=False)
+def get_izleyici() -> Izleyici:
+    return Izleyici(TRACE_LOG_PATH, TRACE_LOG_MB * 1024 * 1024)
+
+
+@contextmanager
+def izle(asama: str, iz_id: str | None = None, **alanlar):
+    """Bir aşamayı süre, yük boyutu ve bellek kullanımıyla izler.
+
+    Blok içinde dönen sözlüğe alan eklenebilir (ör. iz["bayt_cikis"] = len(veri)).
+    İç içe izler üstün iz_id'sini paylaşır; kök iz, farklı rerun ya da iş
+    parçacıklarındaki adımları bağlamak için iz_id alabilir.
+
+    Bellek alanları: rss_fark_bayt (aşama boyunca anlık RSS değişimi),
+    bellek_tepe_bayt (TRACE_MEMORY açıksa tracemalloc tepe değeri; eşzamanlı
+    işlerde yaklaşık) ve surec_rss_tepe_bayt (süreç ömrü boyunca tepe, aşamaya özgü değil).
+    """
+    ust = _AKTIF_IZ.get()
+    iz = {
+        "zaman": datetime.now().isoformat(timespec="milliseconds"),
+        "asama": asama,
+        "iz_id": ust["iz_id"] if ust else iz_id or uuid.uuid4().hex[:16],
+        "ust": ust["asama"] if ust else None,
+        **alanlar,
+    }
+    bellek = tracemalloc.is_tracing()
+    if bellek:
+        bellek_baslangic = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    iz["_cocuk_tepe"] = 0
+    rss_baslangic = rss_simdi_bayt()
+    token = _AKTIF_IZ.set(iz)
+    baslangic = time.perf_counter()
+    try:
+        yield iz
+    except GeneratorExit:
+        iz["kesildi"] = True  # akışı tüketici kapattı; hata sayılmaz
+        raise
+    except BaseException as e:
+        iz["hata"] = type(e).__name__
+        raise
+    finally:
+        iz["sure_ms"] = round((time.perf_counter() - baslangic) * 1000, 3)
+        try:
+            _AKTIF_IZ.reset(token)
+        except ValueError:  # üreteç başka bir bağlamda kapatıldı
+            _AKTIF_IZ.set(ust)
+        cocuk_tepe = iz.pop("_cocuk_tepe")
+        if bellek:
+            tepe = max(tracemalloc.get_traced_memory()[1], cocuk_tepe)
+            iz["bellek_tepe_bayt"] = max(0, tepe - bellek_baslangic)
+            if ust is not None:
+                ust["_cocuk_tepe"] = max(ust.get("_cocuk_tepe", 0), tepe)
+        rss_bitis = rss_simdi_bayt()
+        if rss_baslangic is not None and rss_bitis is not None:
+            iz["rss_fark_bayt"] = rss_bitis - rss_baslangic
+        iz["surec_rss_tepe_bayt"] = rss_tepe_bayt()
+        get_izleyici().kaydet(iz)
+
+
+def gorsel_boyutu(resim: Image.Image) -> str:
+    return f"{resim.width}x{resim.height}"
+
+
+class _MetrikIstegi(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        govde = get_izleyici().prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(govde)))
+        self.end_headers()
+        self.wfile.write(govde)
+
+    def log_message(self, *args):
+        pass  # her scrape'i konsola yazma
+
+
+@st.cache_resource(show_spinner=False)
+def get_metrik_sunucusu() -> http.server.ThreadingHTTPServer | None:
+    """/metrics uç noktasını arka planda sunar (process başına bir kez)."""
+    if not METRICS_PORT:
+        return None
+    try:
+        sunucu = http.server.ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetrikIstegi)
+    except OSError as e:
+        print(f"Metrik sunucusu başlatılamadı ({METRICS_HOST}:{METRICS_PORT}):", e)
+        return None
+    sunucu.daemon_threads = True
+    threading.Thread(target=sunucu.serve_forever, name="metrikler", daemon=True).start()
+    return sunucu
+
+
 # ===========================
 # TEMA LİSTESİ (E-TİCARET ODAKLI)
 # ===========================
@@ -297,6 +728,11 @@ TEMA_LISTESI = {
     "⬜ Saf Beyaz Fon (E-ticaret)": "ACTION_WHITE",
     "⬛ Saf Siyah Fon (Premium)": "ACTION_BLACK",
     "🍦 Krem / Bej Fon (Soft)": "ACTION_BEIGE",
+    # Yerel sahneler (anında, API maliyeti yok)
+    "🍬 Pastel Gradient (Hızlı)": "ACTION_PASTEL",
+    "🌅 Gün Batımı Tonları (Hızlı)": "ACTION_SUNSET",
+    "🌫 Nötr Gri Fon (Hızlı)": "ACTION_GREY",
+    "📦 Ürün Kartı (Hızlı)": "ACTION_CARD",
     # E-ticaret & katalog
     "🛒 Katalog Stüdyosu (Beyaz)": (
         "Clean e-commerce product photo of the object on a pure white seamless background. "
@@ -379,23 +815,154 @@ TEMA_LISTESI = {
     ),
 }
 
+# ===========================
+# HTTP İSTEMCİ (HAVUZ, TEKRAR, SÜRE BÜTÇESİ)
+# ===========================
+class ButceAsildi(requests.Timeout):
+    """Sohbet turu için ayrılan süre bütçesi tükendi; istek hiç gönderilmedi."""
+
+
+_TUR_SONU: ContextVar[float | None] = ContextVar("alptech_tur_sonu", default=None)
+
+
+@contextmanager
+def tur_butcesi(saniye: float):
+    """Bu blok içindeki tüm dış çağrılar için ortak bir son tarih (deadline) belirler."""
+    token = _TUR_SONU.set(time.monotonic() + saniye)
+    try:
+        yield
+    finally:
+        _TUR_SONU.reset(token)
+
+
+def tur_kalan_sure() -> float | None:
+    """Aktif tur bütçesinden kalan saniye; bütçe yoksa None."""
+    son = _TUR_SONU.get()
+    return None if son is None else son - time.monotonic()
+
+
+def istek_zaman_asimi(varsayilan: float) -> float:
+    """Tur bütçesine göre kırpılmış zaman aşımı; bütçe bittiyse ButceAsildi fırlatır."""
+    kalan = tur_kalan_sure()
+    if kalan is None:
+        return varsayilan
+    if kalan <= 0:
+        raise ButceAsildi("Tur süre bütçesi tükendi")
+    return min(varsayilan, kalan)
+
+
+@st.cache_resource(show_spinner=False)
+def get_http_session() -> requests.Session:
+    """Process genelinde keep-alive bağlantı havuzlu tek HTTP oturumu."""
+    oturum = requests.Session()
+    adaptor = HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+    oturum.mount("http://", adaptor)
+    oturum.mount("https://", adaptor)
+    return oturum
+
+
+def http_get(url: str, timeout: float | None = None, **kwargs) -> requests.Response:
+    """Havuzlu GET; geçici hatalarda jitter'lı geri çekilme ile sınırlı sayıda tekrar dener.
+
+    Tekrarlar ve beklemeler aktif tur bütçesinden düşülür; bütçe yetmiyorsa
+    beklemek yerine son sonuç/hata hemen döner.
+    """
+    with izle(f"http_get:{urlsplit(url).hostname}") as iz:
+        resp = _http_get_tekrarli(url, timeout, **kwargs)
+        iz["durum"] = resp.status_code
+        iz["bayt_cikis"] = len(resp.content)
+        return resp
+
+
+def _http_get_tekrarli(url: str, timeout: float | None, **kwargs) -> requests.Response:
+    timeout = timeout or HTTP_TIMEOUT
+    for deneme in range(HTTP_RETRIES + 1):
+        son_deneme = deneme == HTTP_RETRIES
+        try:
+            resp = get_http_session().get(url, timeout=istek_zaman_asimi(timeout), **kwargs)
+            if resp.status_code not in HTTP_RETRY_STATUS or son_deneme:
+                return resp
+        except ButceAsildi:
+            raise
+        except (requests.ConnectionError, requests.Timeout):
+            if son_deneme:
+                raise
+            resp = None
+
+        bekleme = min(2.0, 0.2 * 2**deneme) * random.uniform(0.5, 1.5)
+        kalan = tur_kalan_sure()
+        if kalan is not None and kalan <= bekleme:
+            if resp is not None:
+                return resp
+            raise ButceAsildi("Tekrar deneme için süre kalmadı")
+        time.sleep(bekleme)
+    raise AssertionError("unreachable")
+
+
+@st.cache_resource(show_spinner=False)
+def get_openai_client() -> OpenAI:
+    """Paylaşılan OpenAI istemcisi (bağlantı havuzu dahil); paket ilk çağrıda yüklenir."""
+    from openai import OpenAI
+
+    return OpenAI(api_key=SABIT_API_KEY)
+
+
 # ===========================
 # ZAMAN & HAVA FONKSİYONLARI
 # ===========================
+class SaatSenkronu:
+    """WorldTimeAPI ile saat farkını arka planda ölçer; "şimdi"yi yerelde hesaplar.
+
+    Sıcak yolda ağ çağrısı yoktur: zaman = son senkron anındaki sunucu zamanı +
+    o andan beri geçen monotonik süre. Senkron yoksa yerel Europe/Istanbul kullanılır.
+    """
+
+    def __init__(self):
+        self._senkron: tuple[float, float] | None = None  # (sunucu epoch, monotonic)
+        self.son_senkron: float | None = None
+        threading.Thread(target=self._dongu, name="saat-senkron", daemon=True).start()
+
+    def _olc(self) -> bool:
+        try:
+            t0 = time.monotonic()
+            resp = http_get("http://worldtimeapi.org/api/timezone/Europe/Istanbul", timeout=5)
+            t1 = time.monotonic()
+            if resp.status_code != 200:
+                return False
+            dt_str = resp.json().get("datetime")
+            if not dt_str:
+                return False
+            # Yanıt gidiş-dönüş süresinin ortasında üretilmiş kabul edilir.
+            sunucu = datetime.fromisoformat(dt_str).timestamp() + (t1 - t0) / 2
+            self._senkron = (sunucu, t1)
+            self.son_senkron = time.time()
+            return True
+        except Exception as e:
+            print("saat senkron hata:", e)
+            return False
+
+    def _dongu(self):
+        while True:
+            basarili = self._olc()
+            time.sleep(CLOCK_RESYNC_SECONDS if basarili else 300)
+
+    def simdi(self) -> datetime:
+        tz = ZoneInfo("Europe/Istanbul")
+        senkron = self._senkron
+        if senkron is None:
+            return datetime.now(tz)
+        sunucu, mono = senkron
+        return datetime.fromtimestamp(sunucu + (time.monotonic() - mono), tz)
+
+
+@st.cache_resource(show_spinner=False)
+def get_saat_senkronu() -> SaatSenkronu:
+    return SaatSenkronu()
+
+
 def fetch_tr_time() -> datetime:
-    """Önce WorldTimeAPI, hata olursa local Europe/Istanbul."""
-    try:
-        resp = requests.get(
-            "http://worldtimeapi.org/api/timezone/Europe/Istanbul", timeout=5
-        )
-        if resp.status_code == 200:
-            data = resp.json()
-            dt_str = data.get("datetime")
-            if dt_str:
-                return datetime.fromisoformat(dt_str)
-    except Exception:
-        pass
-    return datetime.now(ZoneInfo("Europe/Istanbul"))
+    """WorldTimeAPI'ye göre düzeltilmiş TR saati (ağ çağrısı yok); senkron yoksa local Europe/Istanbul."""
+    return get_saat_senkronu().simdi()
 
 
 def turkce_zaman_getir() -> str:
@@ -434,56 +1001,539 @@ def get_time_answer() -> str:
     )
 
 
+_TR_KATLAMA = str.maketrans("çğıöşüâîû", "cgiosuaiu")
+
+
+def tr_kucuk(metin: str) -> str:
+    """Türkçe kurallarıyla küçük harf (İ→i, I→ı); uzunluk korunur."""
+    return metin.replace("İ", "i").replace("I", "ı").lower()
+
+
+def tr_anahtar(metin: str) -> str:
+    """Aksan/harf farklarını katlayan, yalnızca harf-rakam içeren arama anahtarı."""
+    return re.sub(r"[^a-z0-9]", "", tr_kucuk(metin).translate(_TR_KATLAMA))
+
+
+def _duzenleme_mesafesi(a: str, b: str, sinir: int) -> int:
+    """Damerau-Levenshtein (bitişik yer değiştirme dahil); sınırı aşınca sinir+1 döner."""
+    if abs(len(a) - len(b)) > sinir:
+        return sinir + 1
+    onceki2, onceki = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        satir = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            maliyet = 0 if a[i - 1] == b[j - 1] else 1
+            satir[j] = min(satir[j - 1] + 1, onceki[j] + 1, onceki[j - 1] + maliyet)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                satir[j] = min(satir[j], onceki2[j - 2] + 1)
+        if min(satir) > sinir:
+            return sinir + 1
+        onceki2, onceki = onceki, satir
+    return onceki[-1]
+
+
+class Gazetteer:
+    """Çevrimdışı il/ilçe dizini: normalize anahtarlı trie + hataya toleranslı arama.
+
+    Kesme işaretli ekler ('da, 'de, 'ta, 'te ...) ve kesmesiz bulunma/ayrılma
+    ekleri ("istanbulda", "izmirden") doğrudan çözülür.
+    """
+
+    # Kesme işareti olmadan kabul edilen ekler (katlanmış biçimde).
+    EKLER = {
+        "", "da", "de", "ta", "te", "dan", "den", "tan", "ten",
+        "daki", "deki", "taki", "teki", "nda", "nde", "ndan", "nden",
+        "ndaki", "ndeki", "nin", "nun", "ya", "ye", "yi", "yu",
+    }
+    # Bulunma/ayrılma ekleri: yazım hatalı kelimede yer adı olma ihtimalini gösterir.
+    YER_EKLERI = {
+        "da", "de", "ta", "te", "dan", "den", "tan", "ten",
+        "daki", "deki", "taki", "teki", "nda", "nde", "ndan", "nden", "ndaki", "ndeki",
+    }
+
+    def __init__(self, yol: str):
+        self.kayitlar: dict[str, dict] = {}
+        self._trie: dict = {}
+        try:
+            with open(yol, "r", encoding="utf-8", newline="") as f:
+                for satir in csv.DictReader(f):
+                    kayit = {
+                        "ad": satir["ad"],
+                        "il": satir["il"],
+                        "tur": satir["tur"],
+                        "coords": (float(satir["lat"]), float(satir["lon"])),
+                    }
+                    self._ekle(tr_anahtar(satir["ad"]), kayit)
+        except (OSError, KeyError, ValueError) as e:
+            print("gazetteer yüklenemedi:", e)
+
+    def _ekle(self, anahtar: str, kayit: dict):
+        self.kayitlar[anahtar] = kayit
+        dugum = self._trie
+        for harf in anahtar:
+            dugum = dugum.setdefault(harf, {})
+        dugum["$"] = kayit
+
+    def _onekler(self, anahtar: str) -> list[tuple[int, dict]]:
+        """Anahtarın öneki olan tüm kayıtlar (kısa → uzun)."""
+        sonuc, dugum = [], self._trie
+        for i, harf in enumerate(anahtar):
+            dugum = dugum.get(harf)
+            if dugum is None:
+                break
+            if "$" in dugum:
+                sonuc.append((i + 1, dugum["$"]))
+        return sonuc
+
+    def bul(self, kelime: str) -> dict | None:
+        """Tek kelimeyi (ekli olabilir) il/ilçe kaydına çözer; hata toleransı yok."""
+        parcalar = re.split(r"['’`]", kelime, maxsplit=1)
+        if len(parcalar) == 2:
+            return self.kayitlar.get(tr_anahtar(parcalar[0]))
+        anahtar = tr_anahtar(kelime)
+        for uzunluk, kayit in reversed(self._onekler(anahtar)):
+            if anahtar[uzunluk:] in self.EKLER:
+                return kayit
+        return None
+
+    def yer_ekli(self, kelime: str) -> bool:
+        """Kelime kesmeli ya da kesmesiz bir bulunma/ayrılma ekiyle mi bitiyor?"""
+        if re.search(r"['’`]", kelime):
+            return True
+        anahtar = tr_anahtar(kelime)
+        return any(anahtar.endswith(ek) and len(anahtar) > len(ek) + 2 for ek in self.YER_EKLERI)
+
+    def yakin(self, kelime: str) -> dict | None:
+        """Yazım hatalı kelime için en yakın tekil kayıt (6+ harfte ≤1 hata, 9+ harfte ≤2).
+
+        5 harf ve altı kökler denenmez ("Kazan"→Kozan, "bura"→Bursa gibi yanlış
+        eşleşmeler). Belirsizlikte (eşit uzaklıkta birden çok kayıt) None döner.
+        """
+        anahtar = tr_anahtar(re.split(r"['’`]", kelime, maxsplit=1)[0])
+        adaylar = {anahtar}
+        for ek in self.EKLER:
+            if ek and anahtar.endswith(ek):
+                adaylar.add(anahtar[: -len(ek)])
+        adaylar = {a for a in adaylar if len(a) >= 6}
+        en_iyi, en_iyi_mesafe, esit = None, 99, False
+        for aday in adaylar:
+            sinir = 2 if len(aday) >= 9 else 1
+            for isim, kayit in self.kayitlar.items():
+                if len(isim) < 5:
+                    continue  # kısa adlarda (Van, Muş, Kars...) tahmin çok riskli
+                mesafe = _duzenleme_mesafesi(aday, isim, sinir)
+                if mesafe > sinir:
+                    continue
+                if mesafe < en_iyi_mesafe:
+                    en_iyi, en_iyi_mesafe, esit = kayit, mesafe, False
+                elif mesafe == en_iyi_mesafe and kayit is not en_iyi:
+                    esit = True
+        return None if esit else en_iyi
+
+
+@st.cache_resource(show_spinner=False)
+def get_gazetteer() -> Gazetteer:
+    return Gazetteer(GAZETTEER_PATH)
+
+
+# Sık geçen ama yer adı olmayan kelimeler (katlanmış); dizin aramasından önce elenir.
+_SEHIR_OLMAYANLAR = {
+    "bugun", "bugunku", "yarin", "yarinki", "simdi", "su", "bu", "o", "disari", "disarida",
+    "burada", "burasi", "orada", "sabah", "aksam", "gece", "hafta", "haftalik", "gunluk",
+    "sizde", "bizde", "sende", "nasil", "guzel", "kotu", "gun", "gunu", "haftasonu",
+    "pazartesi", "sali", "persembe", "cuma", "cumartesi", "bey", "hanim", "hoca",
+}
+# Hem yer adı hem gündelik kelime olanlar (katlanmış): yalnızca kesmeli ekle
+# ("Kemer'de") ya da doğrudan "<yer> hava" kalıbında yer adı sayılır.
+_BELIRSIZ_YER_ADLARI = {
+    "carsamba", "yildirim", "kemer", "kas", "side", "kartal", "fatih", "ordu", "agri",
+    "batman", "pazar",
+}
+
+# Regresyon örnekleri: (mesaj, beklenen yer; None = şehir yok). Bakım panelinde çalışır.
+SEHIR_AYRISTIRMA_ORNEKLERI = [
+    ("İstanbul'da hava nasıl?", "İstanbul"),
+    ("izmirde yarın hava nasıl", "İzmir"),
+    ("Kemer'de hava nasıl?", "Kemer"),
+    ("Kemer hava durumu", "Kemer"),
+    ("Istanbl hava durumu", "İstanbul"),
+    ("Burada hava nasıl?", None),
+    ("Denizi görmek istiyorum, hava nasıl?", None),
+    ("Kazan hava durumu", None),
+    ("Merhaba nasılsın hava nasıl", None),
+    ("Ürün fotoğrafı için bir hava yarat", None),
+    ("borsa bugün nasıl", None),
+    ("Çarşamba günü hava nasıl olacak?", None),
+    ("Yıldırım düşer mi, hava nasıl?", None),
+    ("Fatih Bey hava nasıl", None),
+]
+
+
+def _yer_degil(kelime: str) -> bool:
+    anahtar = tr_anahtar(re.split(r"['’`]", kelime, maxsplit=1)[0])
+    return not anahtar or anahtar in _SEHIR_OLMAYANLAR or anahtar.startswith("hava")
+
+
 def extract_city_from_message(message: str) -> str | None:
-    """Türkçe cümleden şehir adını tahmini çıkarır."""
-    msg = message.lower()
-    msg = re.sub(r"[^\wçğıöşü\s]", " ", msg)
-    tokens = [t for t in msg.split() if t]
-
-    if "hava" in tokens:
-        idx = tokens.index("hava")
-        if idx >= 1:
-            candidate = tokens[idx - 1]
-        else:
-            candidate = tokens[0]
-    elif tokens:
-        candidate = tokens[0]
-    else:
+    """Türkçe cümleden il/ilçe adını çevrimdışı dizinle çıkarır; bulunamazsa None.
+
+    Yazım hatası toleransı yalnızca "<yer> hava" kalıbındaki kelimeye ve
+    bulunma/ayrılma ekli kelimelere uygulanır; diğer kelimeler birebir eşleşmeli.
+    Dizinde olmayan kelime şehir sayılmaz: geocoding yalnızca Türkiye'de arar ve
+    dizin tüm il/ilçeleri kapsar, tahmin ise "nasılsın" gibi kelimeleri API'ye
+    ve ön yükleyiciye taşırdı.
+    """
+    eslesmeler = list(re.finditer(r"[\w'’`]+", message))
+    if not eslesmeler:
         return None
+    kelimeler = [m.group() for m in eslesmeler]
+    gaz = get_gazetteer()
+
+    # "<şehir> hava ..." kalıbı: iki kelime arasında noktalama olmamalı
+    # ("..., hava nasıl" kalıp değildir).
+    hava_idx = next(
+        (i for i, k in enumerate(kelimeler) if tr_anahtar(k).startswith("hava")), None
+    )
+    kalip = None
+    if hava_idx:
+        ara = message[eslesmeler[hava_idx - 1].end() : eslesmeler[hava_idx].start()]
+        if not ara.strip() and not _yer_degil(kelimeler[hava_idx - 1]):
+            kalip = hava_idx - 1
+    sira = [i for i in range(len(kelimeler)) if not _yer_degil(kelimeler[i])]
+    if kalip in sira:
+        sira.remove(kalip)
+        sira.insert(0, kalip)
+
+    def uygun(kayit: dict | None, i: int) -> bool:
+        if kayit is None:
+            return False
+        if tr_anahtar(kayit["ad"]) not in _BELIRSIZ_YER_ADLARI:
+            return True
+        return i == kalip or re.search(r"['’`]", kelimeler[i]) is not None
+
+    for i in sira:
+        kayit = gaz.bul(kelimeler[i])
+        if uygun(kayit, i):
+            return kayit["ad"]
+    for i in sira:
+        if i != kalip and not gaz.yer_ekli(kelimeler[i]):
+            continue
+        kayit = gaz.yakin(kelimeler[i])
+        if uygun(kayit, i):
+            return kayit["ad"]
+    return None
+
+
+def sehir_ayristirma_kontrolu() -> list[dict]:
+    """SEHIR_AYRISTIRMA_ORNEKLERI üzerinde extract_city_from_message sonuçları."""
+    satirlar = []
+    for mesaj, beklenen in SEHIR_AYRISTIRMA_ORNEKLERI:
+        bulunan = extract_city_from_message(mesaj)
+        satirlar.append(
+            {"mesaj": mesaj, "beklenen": beklenen, "bulunan": bulunan, "ok": bulunan == beklenen}
+        )
+    return satirlar
 
-    for suf in ["'da", "'de", "'ta", "'te", "da", "de", "ta", "te"]:
-        if candidate.endswith(suf) and len(candidate) > len(suf) + 1:
-            candidate = candidate[: -len(suf)]
-            break
 
-    candidate = candidate.strip()
-    if not candidate:
+class TTLOnbellek:
+    """Anahtar başına TTL'li, thread-safe ve tek-uçuşlu (single-flight) önbellek.
+
+    Aynı anahtar için eşzamanlı istekler tek bir yükleyici çağrısında birleşir.
+    İçerik JSON olarak diske yazılır; yeniden başlatmada taze kayıtlar geri yüklenir.
+    """
+
+    def __init__(self, yol: str | None = None):
+        self.yol = yol
+        self.isabet = 0
+        self.iska = 0
+        self.birlesen = 0
+        self._veri: dict[str, tuple[float | None, object]] = {}
+        self._ucusta: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._kayit_lock = threading.Lock()
+        self._son_kayit = 0.0
+        self._kirli = False
+        if yol:
+            self._yukle()
+            atexit.register(self.kaydet)
+
+    def yas(self, anahtar: str) -> float | None:
+        """Kaydın bitişine kalan süre (sn); kayıt yoksa None, kalıcıysa inf."""
+        kayit = self._veri.get(anahtar)
+        if kayit is None:
+            return None
+        return float("inf") if kayit[0] is None else kayit[0] - time.time()
+
+    def getir(self, anahtar: str, yukleyici, ttl: float | None, zorla: bool = False):
+        """Taze değeri döndürür; yoksa yükler. ttl=None kalıcı, None sonuç saklanmaz."""
+        with self._lock:
+            kayit = self._veri.get(anahtar)
+            if not zorla and kayit and (kayit[0] is None or kayit[0] > time.time()):
+                self.isabet += 1
+                return kayit[1]
+            ucus = self._ucusta.get(anahtar)
+            lider = ucus is None
+            if lider:
+                ucus = self._ucusta[anahtar] = {"olay": threading.Event()}
+                self.iska += 1
+            else:
+                self.birlesen += 1
+
+        if not lider:
+            if not ucus["olay"].wait(istek_zaman_asimi(HTTP_TIMEOUT * (HTTP_RETRIES + 1))):
+                raise ButceAsildi("Devam eden istek zamanında tamamlanmadı")
+            if "hata" in ucus:
+                raise ucus["hata"]
+            return ucus.get("sonuc")
+
+        try:
+            sonuc = yukleyici()
+            ucus["sonuc"] = sonuc
+            if sonuc is not None:
+                with self._lock:
+                    self._veri[anahtar] = (None if ttl is None else time.time() + ttl, sonuc)
+                    self._kirli = True
+                if time.time() - self._son_kayit > 30:
+                    self.kaydet()
+            return sonuc
+        except Exception as e:
+            ucus["hata"] = e
+            raise
+        finally:
+            with self._lock:
+                self._ucusta.pop(anahtar, None)
+            ucus["olay"].set()
+
+    def _yukle(self):
+        try:
+            with open(self.yol, "r", encoding="utf-8") as f:
+                ham = json.load(f)
+        except (OSError, ValueError):
+            return
+        simdi = time.time()
+        for anahtar, (bitis, deger) in ham.items():
+            if bitis is None or bitis > simdi:
+                self._veri[anahtar] = (bitis, deger)
+
+    def kaydet(self):
+        """Anlık görüntüyü atomik yazar; kayıtlar sıralanır, eski görüntü yenisini ezmez."""
+        if not self.yol or not self._kirli:
+            return
+        with self._kayit_lock:
+            with self._lock:
+                if not self._kirli:
+                    return
+                anlik = dict(self._veri)
+                self._kirli = False
+                self._son_kayit = time.time()
+            gecici = None
+            try:
+                klasor = os.path.dirname(self.yol) or "."
+                os.makedirs(klasor, exist_ok=True)
+                fd, gecici = tempfile.mkstemp(dir=klasor, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(anlik, f, ensure_ascii=False)
+                os.replace(gecici, self.yol)
+                gecici = None
+            except OSError as e:
+                print("hava önbelleği kaydedilemedi:", e)
+            finally:
+                if gecici:
+                    try:
+                        os.remove(gecici)
+                    except OSError:
+                        pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_hava_onbellegi() -> TTLOnbellek:
+    return TTLOnbellek(WEATHER_CACHE_PATH or None)
+
+
+def sehir_anahtari(sehir: str) -> str:
+    """Türkçe büyük/küçük harf kurallarıyla normalize şehir anahtarı (İ→i, I→ı)."""
+    return tr_kucuk(sehir.strip())
+
+
+def _geocode(city: str, limit: int = 1):
+    q = f"{city},TR"
+    url = (
+        "http://api.openweathermap.org/geo/1.0/direct"
+        f"?q={q}&limit={limit}&appid={WEATHER_API_KEY}"
+    )
+    resp = http_get(url)
+    if resp.status_code != 200:
         return None
-    return candidate
+    data = resp.json()
+    if not data:
+        return None
+    first = data[0]
+    return [float(first["lat"]), float(first["lon"])]
 
 
 def resolve_city_to_coords(city: str, limit: int = 1):
-    """OpenWeather Geocoding API ile şehir → (lat, lon)."""
+    """Şehir → (lat, lon): önce çevrimdışı dizin, yoksa OpenWeather Geocoding (kalıcı önbellekli)."""
+    kayit = get_gazetteer().bul(city.strip())
+    if kayit:
+        return kayit["coords"]
     if not WEATHER_API_KEY:
         return None
     try:
-        q = f"{city},TR"
-        url = (
-            "http://api.openweathermap.org/geo/1.0/direct"
-            f"?q={q}&limit={limit}&appid={WEATHER_API_KEY}"
+        coords = get_hava_onbellegi().getir(
+            f"geo:{sehir_anahtari(city)}", lambda: _geocode(city, limit), ttl=None
         )
-        resp = requests.get(url, timeout=10)
-        if resp.status_code != 200:
-            return None
-        data = resp.json()
-        if not data:
-            return None
-        first = data[0]
-        return float(first["lat"]), float(first["lon"])
+        return tuple(coords) if coords else None
     except Exception:
         return None
 
 
+def _anlik_hava_verisi(sehir: str) -> dict | None:
+    """OpenWeather anlık hava verisini (ham JSON) getirir; hata olursa None."""
+    coords = resolve_city_to_coords(sehir)
+    if coords:
+        lat, lon = coords
+        url = (
+            "https://api.openweathermap.org/data/2.5/weather"
+            f"?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric&lang=tr"
+        )
+    else:
+        url = (
+            "https://api.openweathermap.org/data/2.5/weather"
+            f"?q={sehir},TR&appid={WEATHER_API_KEY}&units=metric&lang=tr"
+        )
+    resp = http_get(url)
+    if resp.status_code != 200:
+        return None
+    return resp.json()
+
+
+def _tahmin_verisi(sehir: str) -> dict | None:
+    """OpenWeather One Call günlük tahmin verisini (ham JSON) getirir."""
+    coords = resolve_city_to_coords(sehir)
+    if not coords:
+        return None
+    lat, lon = coords
+    url = (
+        "https://api.openweathermap.org/data/3.0/onecall"
+        f"?lat={lat}&lon={lon}&exclude=minutely,hourly,alerts"
+        f"&appid={WEATHER_API_KEY}&units=metric&lang=tr"
+    )
+    resp = http_get(url)
+    if resp.status_code != 200:
+        return None
+    return resp.json()
+
+
+def hava_verisi(sehir: str, tur: str, zorla: bool = False) -> dict | None:
+    """Önbellekli anlık ("current") veya günlük tahmin ("forecast") verisi."""
+    getirici = _anlik_hava_verisi if tur == "current" else _tahmin_verisi
+    return get_hava_onbellegi().getir(
+        f"{tur}:{sehir_anahtari(sehir)}", lambda: getirici(sehir), WEATHER_MAX_AGE[tur], zorla
+    )
+
+
+class HavaOnYukleyici:
+    """En çok sorulan şehirlerin hava/tahmin verisini arka planda tazeler.
+
+    Veriler ortak hava önbelleğine yazılır; sohbet turu bu şehirler için ağ
+    çağrısı yapmaz. Arka plan döngüsü saatlik çağrı bütçesini
+    (WEATHER_PREFETCH_CALLS_PER_HOUR) aşmaz.
+    """
+
+    SONME_ORANI = 0.9  # her WEATHER_PREFETCH_INTERVAL süresinde popülerlik çarpanı
+    ESIK = 0.05  # bu puanın altına sönen şehir unutulur
+    AZAMI_SEHIR = 500  # izlenen şehir sayısı üst sınırı
+
+    def __init__(self):
+        self.sayac: Counter[str] = Counter()
+        self.gorunen_ad: dict[str, str] = {}
+        self._cagrilar: deque[float] = deque()
+        self._son_sonme = time.time()
+        self._lock = threading.Lock()
+        self._uyandir = threading.Event()
+        if WEATHER_DEFAULT_CITY:
+            self.kaydet(WEATHER_DEFAULT_CITY)
+        threading.Thread(target=self._dongu, name="hava-onyukleme", daemon=True).start()
+
+    def kaydet(self, sehir: str):
+        anahtar = sehir_anahtari(sehir)
+        if not anahtar:
+            return
+        with self._lock:
+            yeni = anahtar not in self.sayac
+            self.sayac[anahtar] += 1
+            self.gorunen_ad.setdefault(anahtar, sehir.strip())
+        if yeni:
+            self._uyandir.set()
+
+    def _butce_var(self, maliyet: int) -> bool:
+        sinir = time.time() - 3600
+        while self._cagrilar and self._cagrilar[0] < sinir:
+            self._cagrilar.popleft()
+        return len(self._cagrilar) + maliyet <= WEATHER_PREFETCH_CALLS_PER_HOUR
+
+    def _son(self):
+        """Popülerliği geçen süreyle orantılı söndürür; sönen ve fazla şehirleri atar.
+
+        Yeni şehir döngüyü erken uyandırdığı için sönme tur sayısına değil
+        zamana bağlıdır. Çağıran self._lock'u tutar.
+        """
+        simdi = time.time()
+        carpan = self.SONME_ORANI ** ((simdi - self._son_sonme) / max(WEATHER_PREFETCH_INTERVAL, 1))
+        self._son_sonme = simdi
+        varsayilan = sehir_anahtari(WEATHER_DEFAULT_CITY or "")
+        for anahtar in list(self.sayac):
+            self.sayac[anahtar] *= carpan
+            if self.sayac[anahtar] < self.ESIK and anahtar != varsayilan:
+                del self.sayac[anahtar]
+        if len(self.sayac) > self.AZAMI_SEHIR:
+            kalan = dict(self.sayac.most_common(self.AZAMI_SEHIR))
+            if varsayilan in self.sayac:
+                kalan.setdefault(varsayilan, self.sayac[varsayilan])
+            self.sayac = Counter(kalan)
+        for anahtar in list(self.gorunen_ad):
+            if anahtar not in self.sayac:
+                del self.gorunen_ad[anahtar]
+
+    def _tur(self):
+        onbellek = get_hava_onbellegi()
+        with self._lock:
+            self._son()
+            populer = [a for a, _ in self.sayac.most_common(WEATHER_PREFETCH_TOP)]
+            varsayilan = sehir_anahtari(WEATHER_DEFAULT_CITY or "")
+            if varsayilan and varsayilan not in populer:
+                populer.append(varsayilan)
+        for anahtar in populer:
+            for tur in ("current", "forecast"):
+                kalan = onbellek.yas(f"{tur}:{anahtar}")
+                # Süresi dolmadan önce, ömrünün yarısında tazele.
+                if kalan is not None and kalan > WEATHER_MAX_AGE[tur] / 2:
+                    continue
+                maliyet = 1 if onbellek.yas(f"geo:{anahtar}") else 2
+                if not self._butce_var(maliyet):
+                    return
+                self._cagrilar.extend([time.time()] * maliyet)
+                try:
+                    hava_verisi(self.gorunen_ad.get(anahtar, anahtar), tur, zorla=True)
+                except Exception as e:
+                    print("hava ön yükleme hata:", anahtar, tur, e)
+
+    def _dongu(self):
+        while True:
+            if WEATHER_API_KEY:
+                try:
+                    self._tur()
+                except Exception as e:
+                    print("hava ön yükleme döngüsü hata:", e, traceback.format_exc())
+            self._uyandir.wait(WEATHER_PREFETCH_INTERVAL)
+            self._uyandir.clear()
+
+
+@st.cache_resource(show_spinner=False)
+def get_hava_onyukleyici() -> HavaOnYukleyici:
+    return HavaOnYukleyici()
+
+
 def get_weather_answer(location: str | None = None) -> str:
     inc_stat("weather_queries")
     if not WEATHER_API_KEY:
@@ -491,26 +1541,14 @@ def get_weather_answer(location: str | None = None) -> str:
 
     city_raw = location or WEATHER_DEFAULT_CITY or "İstanbul"
     sehir = city_raw.strip()
-    coords = resolve_city_to_coords(sehir)
 
     try:
-        if coords:
-            lat, lon = coords
-            url = (
-                "https://api.openweathermap.org/data/2.5/weather"
-                f"?lat={lat}&lon={lon}&appid={WEATHER_API_KEY}&units=metric&lang=tr"
-            )
-        else:
-            url = (
-                "https://api.openweathermap.org/data/2.5/weather"
-                f"?q={sehir},TR&appid={WEATHER_API_KEY}&units=metric&lang=tr"
-            )
-
-        resp = requests.get(url, timeout=10)
-        if resp.status_code != 200:
+        data = hava_verisi(sehir, "current")
+        if data is None:
             return f"{sehir} için anlık hava durumu bulunamadı. Başka bir şehir söyleyebilirsin."
+        # Ön yükleyici yalnızca gerçekten çözülebilen şehirleri izler.
+        get_hava_onyukleyici().kaydet(sehir)
 
-        data = resp.json()
         durum = data["weather"][0]["description"].capitalize()
         derece = data["main"]["temp"]
         his = data["main"].get("feels_like", derece)
@@ -536,29 +1574,22 @@ def get_weather_forecast_answer(location: str | None = None, days: int = 7) -> s
 
     city_raw = location or WEATHER_DEFAULT_CITY or "İstanbul"
     sehir = city_raw.strip()
-    coords = resolve_city_to_coords(sehir)
-    if not coords:
-        return f"{sehir} için konum bilgisi alınamadı; başka bir şehir söyleyebilirsin."
 
-    lat, lon = coords
     try:
-        url = (
-            "https://api.openweathermap.org/data/3.0/onecall"
-            f"?lat={lat}&lon={lon}&exclude=minutely,hourly,alerts"
-            f"&appid={WEATHER_API_KEY}&units=metric&lang=tr"
-        )
-        resp = requests.get(url, timeout=10)
-        if resp.status_code != 200:
-            return f"{sehir} için 7 günlük hava tahmini alınamadı."
+        if not resolve_city_to_coords(sehir):
+            return f"{sehir} için konum bilgisi alınamadı; başka bir şehir söyleyebilirsin."
+        get_hava_onyukleyici().kaydet(sehir)
+        data = hava_verisi(sehir, "forecast")
+        if data is None:
+            return f"{sehir} için {days} günlük hava tahmini alınamadı."
 
-        data = resp.json()
         daily = data.get("daily", [])
         if not daily:
             return f"{sehir} için günlük tahmin verisi bulunamadı."
 
         gun_sayisi = min(days, len(daily))
         sehir_gorunum = sehir.title()
-        lines = [f"📍 **{sehir_gorunum} için 7 günlük hava tahmini:**"]
+        lines = [f"📍 **{sehir_gorunum} için {gun_sayisi} günlük hava tahmini:**"]
         for i in range(gun_sayisi):
             d = daily[i]
             dt = datetime.fromtimestamp(d["dt"], ZoneInfo("Europe/Istanbul"))
@@ -571,221 +1602,1932 @@ def get_weather_forecast_answer(location: str | None = None, days: int = 7) -> s
             )
         return "\n".join(lines)
     except Exception:
-        return "7 günlük hava tahmini alınırken bir sorun oluştu; lütfen daha sonra tekrar dene."
+        return "Hava tahmini alınırken bir sorun oluştu; lütfen daha sonra tekrar dene."
 
 # ===========================
 # GÜVENLİK / FİLTRE
 # ===========================
-BAD_PATTERNS = [
-    r"(?i)küfret",
-    r"(?i)orospu",
-    r"(?i)piç",
-    r"(?i)siktir",
-    r"(?i)ibne",
-    r"(?i)tecavüz",
-    r"(?i)uyuşturucu",
-    r"(?i)intihar",
-    r"(?i)bomba yap",
+# Terimler kelime başında eşleşir. Sonda "*" olan terim Türkçe ek alabilir
+# ("ibne*" → "ibneler"); olmayan yalnızca tam kelime olarak eşleşir
+# ("tecavüz" → "tecavüzden koruma" eşleşmez).
+BAD_TERMS = [
+    "küfret*",
+    "orospu*",
+    "piç*",
+    "siktir*",
+    "ibne*",
+    "tecavüz",
+    "tecavüz et*",
+    "uyuşturucu",
+    "intihar",
+    "bomba yap",
+    "bomba yapma*",
+    "bomba yapım*",
 ]
 
+MODERASYON_RET_MESAJI = (
+    "Bu isteğe doğrudan yardımcı olamam. "
+    "Ancak istediğin konuyu daha güvenli ve olumlu bir şekilde ele almak istersen beraber bakabiliriz. 🙂"
+)
 
-def moderate_content(text: str) -> str | None:
-    for pat in BAD_PATTERNS:
-        if re.search(pat, text):
-            return (
-                "Bu isteğe doğrudan yardımcı olamam. "
-                "Ancak istediğin konuyu daha güvenli ve olumlu bir şekilde ele almak istersen beraber bakabiliriz. 🙂"
-            )
-    return None
-
-# ===========================
-# KİMLİK & CHAT YARDIMCI
-# ===========================
-def custom_identity_interceptor(user_message: str) -> str | None:
-    triggers = [
-        "seni kim yaptı",
-        "seni kim yarattı",
-        "kim geliştirdi",
-        "kimsin",
-        "sen kimsin",
-        "who created you",
-        "who made you",
-        "who built you",
-        "who are you",
-    ]
-    msg = user_message.lower().strip()
-    if any(t in msg for t in triggers):
-        return (
-            "Beni **ALPTECH AI** ekibi geliştirdi 🚀\n\n"
-            "Görevim; senin için akıllı bir stüdyo asistanı olmak, ürün görsellerini profesyonelleştirmek "
-            "ve metin tarafında da markanı güçlendirmek. Her zaman yanındayım. 🙂"
-        )
-    return None
+# Rakam/sembolle harf taklidi (l33t). ç/ş/ğ/ö/ü bilerek katlanmaz: "piç" ≠ "pic".
+_MOD_HARF = str.maketrans("ı0134579@$", "ioieastgas")
 
 
-def custom_utility_interceptor(user_message: str) -> str | None:
-    msg = user_message.lower()
+class Normalizator:
+    """Metni parça parça, durum koruyarak moderasyon alfabesine indirger.
 
-    if "saat" in msg or "tarih" in msg:
-        return get_time_answer()
+    - Türkçe küçük harf, noktalı/noktasız i birleşir, l33t rakamlar harfe döner
+    - Art arda tekrar eden harfler teke iner ("siiiktir" → "siktir")
+    - Harf olmayan her dizi tek boşluk olur; tek harflik parçalar arasındaki
+      boşluksuz noktalama ise tamamen düşer ("s.i.k.t.i.r" → "siktir").
+      Boşlukla ayrılmış tek harfler birleşmez ("Ses i b ne" olduğu gibi kalır).
+    Akış parçalarının nereden bölündüğü sonucu değiştirmez.
+    """
 
-    if "7 günlük hava" in msg or "7 gunluk hava" in msg or "haftalık hava" in msg:
-        city = extract_city_from_message(user_message) or WEATHER_DEFAULT_CITY
-        return get_weather_forecast_answer(city)
+    def __init__(self):
+        self.son = ""  # en son üretilen karakter
+        self.parca_uzunlugu = 0  # ayraçtan beri gelen harf sayısı
+        self.onceki_parca = 0  # ayraçtan önceki harf dizisinin uzunluğu
+        self.ayrac = False
+        self.bosluklu = False  # geçerli ayraç boşluk içeriyor mu
+
+    def besle(self, metin: str) -> str:
+        cikti = []
+        for c in tr_kucuk(metin).translate(_MOD_HARF):
+            if not c.isalpha():
+                if self.parca_uzunlugu:
+                    self.onceki_parca = self.parca_uzunlugu
+                    self.parca_uzunlugu = 0
+                    self.ayrac = True
+                    self.bosluklu = False
+                if c.isspace():
+                    self.bosluklu = True
+                continue
+            if self.ayrac:
+                self.ayrac = False
+                if not (self.onceki_parca == 1 and not self.bosluklu and self.son != " "):
+                    self.son = " "
+                    cikti.append(" ")
+                elif c == self.son:
+                    # "s.s.i.k" gibi: birleşen parçada da tekrar teke iner
+                    self.parca_uzunlugu = 1
+                    continue
+            self.parca_uzunlugu += 1
+            if c != self.son:
+                self.son = c
+                cikti.append(c)
+        return "".join(cikti)
+
+
+def moderasyon_normalize(metin: str) -> str:
+    return Normalizator().besle(metin).strip()
+
+
+class AhoCorasick:
+    """Terim listesini tek otomata derler; metin tek geçişte taranır."""
+
+    def __init__(self, terimler: list[str]):
+        self.terimler = terimler
+        self.gecis: list[dict[str, int]] = [{}]
+        self.hata: list[int] = [0]
+        self.cikis: list[list[int]] = [[]]
+        for sira, terim in enumerate(terimler):
+            durum = 0
+            for c in terim:
+                sonraki = self.gecis[durum].get(c)
+                if sonraki is None:
+                    sonraki = len(self.gecis)
+                    self.gecis[durum][c] = sonraki
+                    self.gecis.append({})
+                    self.hata.append(0)
+                    self.cikis.append([])
+                durum = sonraki
+            self.cikis[durum].append(sira)
+
+        kuyruk = deque(self.gecis[0].values())
+        while kuyruk:
+            durum = kuyruk.popleft()
+            for c, sonraki in self.gecis[durum].items():
+                kuyruk.append(sonraki)
+                geri = self.hata[durum]
+                while geri and c not in self.gecis[geri]:
+                    geri = self.hata[geri]
+                self.hata[sonraki] = self.gecis[geri].get(c, 0)
+                self.cikis[sonraki] += self.cikis[self.hata[sonraki]]
+
+    def ara(self, metin: str, durum: int = 0) -> tuple[str | None, int]:
+        """İlk eşleşen terimi (yoksa None) ve taramanın bittiği durumu döner."""
+        gecis, hata, cikis = self.gecis, self.hata, self.cikis
+        for c in metin:
+            while durum and c not in gecis[durum]:
+                durum = hata[durum]
+            durum = gecis[durum].get(c, 0)
+            if cikis[durum]:
+                return self.terimler[cikis[durum][0]], durum
+        return None, durum
+
+    def hepsi(self, metin: str):
+        """Metindeki tüm (örtüşenler dahil) eşleşmeleri sırayla üretir."""
+        gecis, hata, cikis = self.gecis, self.hata, self.cikis
+        durum = 0
+        for c in metin:
+            while durum and c not in gecis[durum]:
+                durum = hata[durum]
+            durum = gecis[durum].get(c, 0)
+            for sira in cikis[durum]:
+                yield self.terimler[sira]
+
+
+class ModerasyonAkisi:
+    """Parça parça gelen (stream) model çıktısını artımlı tarar.
+
+    Son kelime ancak bitir() ile kapanır; ek almayan terimler sonda orada yakalanır.
+    """
 
-    if "hava" in msg or "hava durumu" in msg or "hava nasıl" in msg:
-        city = extract_city_from_message(user_message) or WEATHER_DEFAULT_CITY
-        return get_weather_answer(city)
+    def __init__(self, otomat: AhoCorasick):
+        self.otomat = otomat
+        self.normalizator = Normalizator()
+        self.eslesme, self.durum = otomat.ara(" ")
+        self.bitti = False
 
-    return None
+    def besle(self, parca: str) -> str | None:
+        if self.eslesme is None:
+            self.eslesme, self.durum = self.otomat.ara(
+                self.normalizator.besle(parca), self.durum
+            )
+        return self.eslesme
 
+    def bitir(self) -> str | None:
+        if self.eslesme is None and not self.bitti:
+            self.bitti = True
+            self.eslesme, self.durum = self.otomat.ara(" ", self.durum)
+        return self.eslesme
 
-def build_system_talimati():
-    zaman_bilgisi = turkce_zaman_getir()
-    return f"""
-    Senin adın **ALPTECH AI**.
-    ALPTECH AI ekibi tarafından geliştirilen, modern ve profesyonel bir yapay zeka asistansın.
 
-    Odak noktaların:
-    - Ürün görselleri üzerinde çalışma (arka plan kaldırma, sahne oluşturma, e-ticaret görselleri).
-    - E-ticaret odaklı metinler yazma (ürün açıklaması, kampanya metni, sosyal medya postu).
-    - Genel sorularda açıklayıcı, sade cevaplar verme.
+@st.cache_resource(show_spinner=False)
+def get_moderasyon_otomati(terimler: tuple[str, ...]) -> AhoCorasick:
+    """Terimleri kelime sınırlı desenlere derler (bkz. BAD_TERMS ek kuralı).
 
-    Her zaman kendini "ALPTECH AI" olarak tanıt.
-    Seni kimin geliştirdiği sorulduğunda: "ALPTECH AI ekibi" de.
-    Mümkün olduğunca kısa ama net cevap ver; kullanıcı isterse detaya gir.
-    Sistem notu: Bu yanıtlar {zaman_bilgisi} tarihinde oluşturuluyor.
+    Çevreleyen boşluklar kelime sınırını otomatın içine taşır: metin de
+    boşlukla çevrili taranır. Çok kelimeli terimler bitişik yazımla da aranır.
     """
+    desenler = set()
+    for terim in terimler:
+        ekli = terim.endswith("*")
+        normal = moderasyon_normalize(terim.rstrip("*"))
+        if len(normal) < 2:
+            continue
+        son = "" if ekli else " "
+        desenler.add(f" {normal}{son}")
+        desenler.add(f" {normal.replace(' ', '')}{son}")
+    return AhoCorasick(sorted(desenler))
 
 
-def normal_sohbet(client: OpenAI):
-    system_talimati = build_system_talimati()
-    max_context = 40
-    messages = [{"role": "system", "content": system_talimati}]
-    history_slice = st.session_state.chat_history[-max_context:]
+def moderasyon_otomati() -> AhoCorasick:
+    return get_moderasyon_otomati(tuple(BAD_TERMS) + tuple(MODERATION_EXTRA_TERMS))
 
-    for i, msg in enumerate(history_slice):
-        api_role = "user" if msg["role"] == "user" else "assistant"
-        if api_role == "user":
-            if (
-                i == len(history_slice) - 1
-                and st.session_state.get("chat_image") is not None
-            ):
-                img_bytes = st.session_state.chat_image
-                b64 = base64.b64encode(img_bytes).decode("utf-8")
-                content = [
-                    {"type": "text", "text": msg["content"]},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:image/png;base64,{b64}"},
-                    },
-                ]
-                messages.append({"role": "user", "content": content})
-            else:
-                messages.append({"role": "user", "content": msg["content"]})
-        else:
-            messages.append({"role": "assistant", "content": msg["content"]})
 
-    model_to_use = st.secrets.get("OPENAI_MODEL", DEFAULT_MODEL)
-    try:
-        response = client.chat.completions.create(
-            model=model_to_use,
-            messages=messages,
-            temperature=0.2,
-            max_tokens=1200,
-        )
-        try:
-            return response.choices[0].message.content
-        except Exception:
-            return response.choices[0].text
-    except Exception as e:
-        tb = traceback.format_exc()
-        st.error("⚠️ Sohbet API çağrısında hata. Konsolu kontrol et.")
-        print("Chat API HATA:", e, tb)
-        return "Üzgünüm, sohbet hizmetinde şu an bir sorun var."
+def moderasyon_eslesmesi(text: str) -> str | None:
+    """Metinde geçen (normalize edilmiş) yasaklı terim; yoksa None."""
+    eslesme = moderasyon_otomati().ara(f" {moderasyon_normalize(text)} ")[0]
+    return eslesme.strip() if eslesme else None
 
-# ===========================
-# GÖRSEL İŞLEME
-# ===========================
-def resmi_hazirla(image: Image.Image):
-    kare_resim = Image.new("RGBA", (1024, 1024), (0, 0, 0, 0))
-    image.thumbnail((850, 850), Image.Resampling.LANCZOS)
-    x = (1024 - image.width) // 2
-    y = (1024 - image.height) // 2
-    kare_resim.paste(image, (x, y), image if image.mode == "RGBA" else None)
-    return kare_resim
 
+def moderate_content(text: str) -> str | None:
+    if moderasyon_eslesmesi(text):
+        return MODERASYON_RET_MESAJI
+    return None
 
-def bayt_cevir(image: Image.Image):
-    buf = BytesIO()
-    image.save(buf, format="PNG")
-    buf.seek(0)
-    return buf.getvalue()
 
+def moderasyon_benchmark(
+    terim_sayilari=(10, 100, 1000, 5000), metin_kb: int = 64
+) -> list[dict]:
+    """Otomat ile terim başına re.search döngüsünün verimini (MB/sn) karşılaştırır."""
+    rastgele = random.Random(7)
+    harfler = "abcçdefgğhıijklmnoöprsştuüvyz"
+    kelimeler = [
+        "".join(rastgele.choice(harfler) for _ in range(rastgele.randint(2, 9)))
+        for _ in range(2000)
+    ]
+    metin = ""
+    while len(metin) < metin_kb * 1024:
+        metin += " ".join(rastgele.choices(kelimeler, k=200)) + ". "
+    mb = len(metin.encode("utf-8")) / 1e6
+
+    sonuclar = []
+    for sayi in terim_sayilari:
+        terimler = list(BAD_TERMS)
+        while len(terimler) < sayi:
+            terimler.append("".join(rastgele.choice(harfler) for _ in range(8)))
+
+        baslangic = time.perf_counter()
+        otomat = AhoCorasick(sorted({moderasyon_normalize(t) for t in terimler}))
+        derleme = time.perf_counter() - baslangic
+        baslangic = time.perf_counter()
+        otomat.ara(moderasyon_normalize(metin))
+        otomat_sure = time.perf_counter() - baslangic
+
+        desenler = [re.compile(re.escape(t), re.IGNORECASE) for t in terimler]
+        baslangic = time.perf_counter()
+        for desen in desenler:
+            desen.search(metin)
+        regex_sure = time.perf_counter() - baslangic
+
+        sonuclar.append(
+            {
+                "terim": sayi,
+                "derleme_ms": round(derleme * 1000, 1),
+                "otomat_MB/sn": round(mb / otomat_sure, 2),
+                "regex_döngü_MB/sn": round(mb / regex_sure, 2),
+            }
+        )
+    return sonuclar
+
+# ===========================
+# SOHBET DEPOSU (SQLITE)
+# ===========================
+_SOHBET_SEMASI = """
+CREATE TABLE IF NOT EXISTS oturumlar (
+    id TEXT PRIMARY KEY,
+    kullanici TEXT NOT NULL,
+    ad TEXT NOT NULL,
+    olusturma REAL NOT NULL,
+    guncelleme REAL NOT NULL,
+    mesaj_sayisi INTEGER NOT NULL DEFAULT 0,
+    ozet TEXT NOT NULL DEFAULT '',
+    ozet_kapsam INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS oturum_kullanici ON oturumlar (kullanici, guncelleme);
+CREATE TABLE IF NOT EXISTS mesajlar (
+    id INTEGER PRIMARY KEY,
+    oturum TEXT NOT NULL REFERENCES oturumlar (id) ON DELETE CASCADE,
+    sira INTEGER NOT NULL,
+    rol TEXT NOT NULL,
+    icerik TEXT NOT NULL,
+    zaman REAL NOT NULL,
+    UNIQUE (oturum, sira)
+);
+"""
+
+# İçeriksiz (contentless) FTS5 dizini Türkçe katlanmış metni tutar ("ayın" ~ "ayin").
+_SOHBET_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS mesaj_ara USING fts5 (icerik, content='', tokenize='unicode61');
+CREATE TRIGGER IF NOT EXISTS mesaj_ara_ekle AFTER INSERT ON mesajlar BEGIN
+    INSERT INTO mesaj_ara (rowid, icerik) VALUES (new.id, tr_katla(new.icerik));
+END;
+CREATE TRIGGER IF NOT EXISTS mesaj_ara_sil AFTER DELETE ON mesajlar BEGIN
+    INSERT INTO mesaj_ara (mesaj_ara, rowid, icerik) VALUES ('delete', old.id, tr_katla(old.icerik));
+END;
+"""
+
+
+def tr_katla(metin: str) -> str:
+    """Uzunluğu koruyan Türkçe katlama: küçük harf, aksansız (arama için)."""
+    return tr_kucuk(metin).translate(_TR_KATLAMA)
+
+
+def _arama_parcasi(icerik: str, kelimeler: list[str], genislik: int = 40) -> str:
+    """Eşleşen ilk kelimenin çevresinden, eşleşmesi kalın yazılmış kısa alıntı."""
+    katli = tr_katla(icerik)
+    konum = min((i for i in (katli.find(k) for k in kelimeler) if i >= 0), default=-1)
+    if konum < 0:
+        return icerik[: genislik * 2]
+    uzunluk = next(len(k) for k in kelimeler if katli.startswith(k, konum))
+    bas = max(0, konum - genislik)
+    son = min(len(icerik), konum + uzunluk + genislik)
+    return (
+        ("…" if bas else "")
+        + icerik[bas:konum]
+        + f"**{icerik[konum:konum + uzunluk]}**"
+        + icerik[konum + uzunluk : son]
+        + ("…" if son < len(icerik) else "")
+    ).replace("\n", " ")
+
+
+class SohbetDeposu:
+    """Konuşmaların kalıcı deposu: SQLite (WAL) + FTS5 tam metin arama.
+
+    Tek bağlantı tüm oturumlarca kilitle paylaşılır; FTS5 derlenmemişse arama
+    LIKE ile yapılır.
+    """
+
+    def __init__(self, yol: str):
+        os.makedirs(os.path.dirname(yol) or ".", exist_ok=True)
+        self._db = sqlite3.connect(yol, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.create_function("tr_katla", 1, tr_katla, deterministic=True)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(_SOHBET_SEMASI)
+            try:
+                self._db.executescript(_SOHBET_FTS)
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                print("FTS5 yok, arama LIKE ile yapılacak:", e)
+                self.fts = False
+
+    def oturumlar(self, kullanici: str, limit: int = 50) -> list[dict]:
+        """Yalnızca üst veri (mesajlar yüklenmez), en son güncellenen önce."""
+        with self._lock:
+            satirlar = self._db.execute(
+                "SELECT id, ad, guncelleme, mesaj_sayisi FROM oturumlar "
+                "WHERE kullanici = ? ORDER BY guncelleme DESC LIMIT ?",
+                (kullanici, limit),
+            ).fetchall()
+        return [dict(s) for s in satirlar]
+
+    def oturum(self, oturum_id: str) -> dict | None:
+        with self._lock:
+            satir = self._db.execute(
+                "SELECT * FROM oturumlar WHERE id = ?", (oturum_id,)
+            ).fetchone()
+        return dict(satir) if satir else None
+
+    def oturum_olustur(self, kullanici: str, ad: str) -> str:
+        oturum_id = uuid.uuid4().hex
+        simdi = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO oturumlar (id, kullanici, ad, olusturma, guncelleme) VALUES (?, ?, ?, ?, ?)",
+                (oturum_id, kullanici, ad, simdi, simdi),
+            )
+        return oturum_id
+
+    def mesaj_ekle(self, oturum_id: str, rol: str, icerik: str) -> int:
+        """Mesajı sona ekler; oturum içindeki sıra numarasını döner."""
+        simdi = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                sira = self._db.execute(
+                    "SELECT mesaj_sayisi FROM oturumlar WHERE id = ?", (oturum_id,)
+                ).fetchone()[0]
+                self._db.execute(
+                    "INSERT INTO mesajlar (oturum, sira, rol, icerik, zaman) VALUES (?, ?, ?, ?, ?)",
+                    (oturum_id, sira, rol, icerik, simdi),
+                )
+                self._db.execute(
+                    "UPDATE oturumlar SET mesaj_sayisi = ?, guncelleme = ? WHERE id = ?",
+                    (sira + 1, simdi, oturum_id),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return sira
+
+    def mesajlar(self, oturum_id: str, once: int | None = None, limit: int = 50) -> list[dict]:
+        """`once` sırasından önceki (yoksa en son) `limit` mesaj, eskiden yeniye."""
+        with self._lock:
+            satirlar = self._db.execute(
+                "SELECT sira, rol, icerik FROM mesajlar WHERE oturum = ? AND sira < ? "
+                "ORDER BY sira DESC LIMIT ?",
+                (oturum_id, once if once is not None else 2**62, limit),
+            ).fetchall()
+        return [
+            {"role": s["rol"], "content": s["icerik"], "sira": s["sira"]} for s in reversed(satirlar)
+        ]
+
+    def mesaj_araligi(self, oturum_id: str, bas: int, son: int, limit: int = 50) -> list[dict]:
+        """bas <= sira < son aralığındaki ilk `limit` mesaj, eskiden yeniye."""
+        with self._lock:
+            satirlar = self._db.execute(
+                "SELECT sira, rol, icerik FROM mesajlar WHERE oturum = ? AND sira >= ? "
+                "AND sira < ? ORDER BY sira LIMIT ?",
+                (oturum_id, bas, son, limit),
+            ).fetchall()
+        return [{"role": s["rol"], "content": s["icerik"], "sira": s["sira"]} for s in satirlar]
+
+    def ozet_kaydet(self, oturum_id: str, kapsam: int, metin: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE oturumlar SET ozet = ?, ozet_kapsam = ? WHERE id = ?",
+                (metin, kapsam, oturum_id),
+            )
+
+    def ara(self, kullanici: str, sorgu: str, limit: int = 20) -> list[dict]:
+        """Kullanıcının tüm konuşmalarında tam metin arama: oturum, ad, sira, parca."""
+        kelimeler = re.findall(r"\w+", tr_katla(sorgu))
+        if not kelimeler:
+            return []
+        with self._lock:
+            if self.fts:
+                satirlar = self._db.execute(
+                    "SELECT m.oturum, o.ad, m.sira, m.icerik "
+                    "FROM mesaj_ara JOIN mesajlar m ON m.id = mesaj_ara.rowid "
+                    "JOIN oturumlar o ON o.id = m.oturum "
+                    "WHERE mesaj_ara MATCH ? AND o.kullanici = ? ORDER BY rank LIMIT ?",
+                    (" ".join(f'"{k}"*' for k in kelimeler), kullanici, limit),
+                ).fetchall()
+            else:
+                satirlar = self._db.execute(
+                    "SELECT m.oturum, o.ad, m.sira, m.icerik "
+                    "FROM mesajlar m JOIN oturumlar o ON o.id = m.oturum "
+                    "WHERE tr_katla(m.icerik) LIKE ? AND o.kullanici = ? ORDER BY m.zaman DESC LIMIT ?",
+                    (f"%{' '.join(kelimeler)}%", kullanici, limit),
+                ).fetchall()
+        return [
+            {
+                "oturum": s["oturum"],
+                "ad": s["ad"],
+                "sira": s["sira"],
+                "parca": _arama_parcasi(s["icerik"], kelimeler),
+            }
+            for s in satirlar
+        ]
+
+
+@st.cache_resource(show_spinner=False)
+def get_sohbet_deposu() -> SohbetDeposu:
+    return SohbetDeposu(CHAT_DB_PATH)
+
+
+class YanitOnbellegi:
+    """Birebir aynı istekler için LLM yanıt önbelleği (SQLite, TTL + boyut sınırı).
+
+    Anahtar; normalize edilmiş mesajlar, model, sistem talimatı sürümü ve günün
+    tarihinden türetilir ("bugün", "yarın" gibi yanıtlar ertesi gün tekrar
+    kullanılmaz). Sınır aşılınca en uzun süredir okunmayan kayıtlar silinir.
+    """
+
+    def __init__(self, yol: str, ttl: float, azami_bayt: int):
+        os.makedirs(os.path.dirname(yol) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.azami_bayt = azami_bayt
+        self.isabet = 0
+        self.iska = 0
+        self._db = sqlite3.connect(yol, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS yanitlar (anahtar TEXT PRIMARY KEY, yanit TEXT NOT NULL, "
+                "zaman REAL NOT NULL, son_erisim REAL NOT NULL, boyut INTEGER NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS yanit_erisim ON yanitlar (son_erisim)")
+            self.toplam_bayt = self._db.execute(
+                "SELECT COALESCE(SUM(boyut), 0) FROM yanitlar"
+            ).fetchone()[0]
+
+    @staticmethod
+    def anahtar(model: str, mesajlar: list[dict], tarih: str) -> str:
+        def sade(icerik):
+            if isinstance(icerik, str):
+                return " ".join(tr_kucuk(icerik).split())
+            return [sade(p) if isinstance(p, str) else p for p in icerik]
+
+        govde = {
+            "surum": SISTEM_TALIMATI_SURUMU,
+            "model": model,
+            "tarih": tarih,
+            "mesajlar": [(m["role"], sade(m["content"])) for m in mesajlar],
+        }
+        return hashlib.sha256(
+            json.dumps(govde, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def getir(self, anahtar: str) -> str | None:
+        simdi = time.time()
+        with self._lock:
+            satir = self._db.execute(
+                "SELECT yanit, zaman FROM yanitlar WHERE anahtar = ?", (anahtar,)
+            ).fetchone()
+            if satir is None or simdi - satir[1] > self.ttl:
+                self.iska += 1
+                return None
+            self._db.execute(
+                "UPDATE yanitlar SET son_erisim = ? WHERE anahtar = ?", (simdi, anahtar)
+            )
+            self.isabet += 1
+            return satir[0]
+
+    def koy(self, anahtar: str, yanit: str):
+        simdi = time.time()
+        boyut = len(yanit.encode("utf-8"))
+        with self._lock:
+            eski = self._db.execute(
+                "SELECT boyut FROM yanitlar WHERE anahtar = ?", (anahtar,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO yanitlar VALUES (?, ?, ?, ?, ?)",
+                (anahtar, yanit, simdi, simdi, boyut),
+            )
+            self.toplam_bayt += boyut - (eski[0] if eski else 0)
+            if self.toplam_bayt > self.azami_bayt:
+                self._budama(simdi)
+
+    def _budama(self, simdi: float):
+        """Süresi dolanları, sonra en eski erişilenleri sınırın %90'ına inene dek siler."""
+        self._db.execute("DELETE FROM yanitlar WHERE zaman < ?", (simdi - self.ttl,))
+        self.toplam_bayt = self._db.execute(
+            "SELECT COALESCE(SUM(boyut), 0) FROM yanitlar"
+        ).fetchone()[0]
+        hedef = self.azami_bayt * 0.9
+        for anahtar, boyut in self._db.execute(
+            "SELECT anahtar, boyut FROM yanitlar ORDER BY son_erisim"
+        ).fetchall():
+            if self.toplam_bayt <= hedef:
+                break
+            self._db.execute("DELETE FROM yanitlar WHERE anahtar = ?", (anahtar,))
+            self.toplam_bayt -= boyut
+
+
+@st.cache_resource(show_spinner=False)
+def get_yanit_onbellegi() -> YanitOnbellegi:
+    return YanitOnbellegi(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MB * 1024 * 1024)
+
+
+def yanit_onbellegi() -> YanitOnbellegi | None:
+    """Yanıt önbelleği; yol yazılamıyorsa None (sohbet önbelleksiz sürer)."""
+    try:
+        return get_yanit_onbellegi()
+    except (OSError, sqlite3.Error) as e:
+        print("yanıt önbelleği kullanılamıyor:", e)
+        return None
+
+
+def kullanici_kimligi() -> str:
+    """Tarayıcıya bağlı kullanıcı kimliği; CHAT_USER_COOKIE çerezinde tutulur.
+
+    Giriş sistemi yoktur: bu kimlik tek kimlik bilgisidir ve değerini bilen herkes
+    konuşma geçmişini okuyabilir. Bu yüzden paylaşılabilir URL'de tutulmaz; eski
+    ?kullanici=... bağlantıları bir kez çereze taşınıp adres çubuğundan silinir.
+    Yeni yazılan çerez oturum bitene kadar sunucuya gelmez; kimlik bu yüzden
+    oturum başına bir kez belirlenip session_state'te tutulur.
+    """
+    eski = st.query_params.get("kullanici", "")
+    if "kullanici" in st.query_params:
+        del st.query_params["kullanici"]
+    if st.session_state.get("kullanici_kimligi"):
+        return st.session_state.kullanici_kimligi
+    cerezler = getattr(getattr(st, "context", None), "cookies", None) or {}
+    kimlik = cerezler.get(CHAT_USER_COOKIE, "")
+    if not re.fullmatch(r"[0-9a-f]{32}", kimlik):
+        kimlik = eski if re.fullmatch(r"[0-9a-f]{32}", eski) else uuid.uuid4().hex
+        components.html(
+            f"<script>window.parent.document.cookie = '{CHAT_USER_COOKIE}={kimlik}; "
+            "max-age=31536000; path=/; SameSite=Strict';</script>",
+            height=0,
+        )
+    st.session_state.kullanici_kimligi = kimlik
+    return kimlik
+
+
+def oturum_ac(oturum_id: str):
+    """Oturumu aktif yapar; yalnızca son mesaj sayfası belleğe alınır."""
+    st.session_state.current_session = oturum_id
+    st.session_state.chat_history = get_sohbet_deposu().mesajlar(oturum_id, limit=CHAT_PAGE_SIZE)
+    st.session_state.sohbet_penceresi = CHAT_WINDOW
+
+
+def yeni_oturum(ad: str, karsilama: str):
+    oturum_ac(get_sohbet_deposu().oturum_olustur(st.session_state.sohbet_kullanici, ad))
+    mesaj_ekle("assistant", karsilama)
+
+
+def sohbet_oturumunu_hazirla():
+    """Kullanıcının en son konuşmasını açar (yoksa ilkini oluşturur); oturum başına bir kez."""
+    if st.session_state.get("sohbet_kullanici") is not None:
+        return
+    st.session_state.sohbet_kullanici = kullanici_kimligi()
+    son = get_sohbet_deposu().oturumlar(st.session_state.sohbet_kullanici, limit=1)
+    if son:
+        oturum_ac(son[0]["id"])
+    else:
+        yeni_oturum("Oturum 1", "Merhaba! Hangi modu kullanmak istersin?")
+
+
+def mesaj_ekle(rol: str, icerik: str):
+    """Mesajı aktif konuşmaya ekler ve depoya yazar."""
+    gecmis = st.session_state.chat_history
+    try:
+        sira = get_sohbet_deposu().mesaj_ekle(st.session_state.current_session, rol, icerik)
+    except Exception as e:
+        print("Sohbet deposu yazma hatası:", e)
+        sira = gecmis[-1]["sira"] + 1 if gecmis else 0
+    gecmis.append({"role": rol, "content": icerik, "sira": sira})
+    # Bellekte yalnızca görünen pencere (en az bir sayfa) tutulur; eskisi depodan okunur.
+    pencere = st.session_state.get("sohbet_penceresi", CHAT_WINDOW)
+    fazla = len(gecmis) - max(CHAT_PAGE_SIZE, pencere)
+    if fazla > 0:
+        del gecmis[:fazla]
+
+
+def eski_mesajlari_yukle() -> int:
+    """Aktif konuşmanın bir önceki mesaj sayfasını başa ekler; eklenen sayıyı döner."""
+    gecmis = st.session_state.chat_history
+    if not gecmis or gecmis[0]["sira"] == 0:
+        return 0
+    eski = get_sohbet_deposu().mesajlar(
+        st.session_state.current_session, once=gecmis[0]["sira"], limit=CHAT_PAGE_SIZE
+    )
+    gecmis[:0] = eski
+    return len(eski)
+
+
+# ===========================
+# KİMLİK & CHAT YARDIMCI
+# ===========================
+KIMLIK_YANITI = (
+    "Beni **ALPTECH AI** ekibi geliştirdi 🚀\n\n"
+    "Görevim; senin için akıllı bir stüdyo asistanı olmak, ürün görsellerini profesyonelleştirmek "
+    "ve metin tarafında da markanı güçlendirmek. Her zaman yanındayım. 🙂"
+)
+
+# Niyet tablosu: ifadeler kelime sınırıyla eşleşir, "tam" yalnızca mesajın
+# tamamıyla. Birden çok niyet tutarsa önceliği yüksek olan kazanır.
+NIYETLER = [
+    {
+        "ad": "kimlik",
+        "oncelik": 40,
+        "ifadeler": [
+            "seni kim yaptı",
+            "seni kim yarattı",
+            "kim geliştirdi",
+            "kimsin",
+            "who created you",
+            "who made you",
+            "who built you",
+            "who are you",
+        ],
+    },
+    {
+        "ad": "tahmin",
+        "oncelik": 30,
+        "ifadeler": [
+            "günlük hava",
+            "haftalık hava",
+            "hava tahmini",
+            "hafta hava",
+            "bu hafta hava",
+            "weather forecast",
+        ],
+    },
+    {
+        "ad": "hava",
+        "oncelik": 20,
+        "ifadeler": [
+            "hava durumu",
+            "hava nasıl",
+            "havalar nasıl",
+            "havası nasıl",
+            "hava sıcak mı",
+            "hava soğuk mu",
+            "kaç derece",
+            "yağmur yağacak mı",
+            "kar yağacak mı",
+            "weather",
+        ],
+        # Tek başına "hava" ("hava temalı kampanya") yalnızca mesajda şehir varsa sayılır.
+        "sehirle": ["hava", "havası", "havalar"],
+    },
+    {
+        "ad": "saat",
+        "oncelik": 10,
+        "ifadeler": [
+            "saat kaç",
+            "saatler kaç",
+            "şu an saat",
+            "şimdi saat",
+            "bugünün tarihi",
+            "bugün tarih",
+            "tarih ne",
+            "ayın kaçı",
+            "günlerden ne",
+            "hangi gündeyiz",
+            "what time",
+        ],
+        "tam": ["saat", "tarih", "saat ve tarih"],
+    },
+]
+TAHMIN_EN_FAZLA_GUN = 8  # One Call "daily" dizisi
+# Gün sayısı yalnızca hava ifadesine bitişikse okunur ("5 günlük hava", "hava tahmini 3 gün");
+# "7 gün içinde teslim ... hava durumu" gibi ilgisiz sayılar alınmaz.
+_GUN_KALIBI = re.compile(
+    r" (\d+) ?gun(?:luk)?(?: boyunca| icin)? (?:hava|tahmin)"
+    r"| hava (?:durumu |tahmini )?(\d+) ?gun"
+)
+
+
+def niyet_normalize(metin: str) -> str:
+    """Katlanmış, kelimeleri tek boşlukla ayrılmış ve boşlukla çevrili metin."""
+    sade = re.sub(r"[^a-z0-9]+", " ", tr_kucuk(metin).translate(_TR_KATLAMA)).strip()
+    return f" {sade} "
+
+
+class NiyetYonlendirici:
+    """Niyet tablosunu tek otomata derler; mesaj tek geçişte yönlendirilir."""
+
+    def __init__(self, tablo: list[dict]):
+        # kayıt: (öncelik, şehir şartı yok mu, niyet); şartsız ifade eşit öncelikte kazanır
+        self.ifadeler: dict[str, tuple[int, bool, str]] = {}
+        self.tam: dict[str, tuple[int, bool, str]] = {}
+        for niyet in tablo:
+            kayit = (niyet["oncelik"], True, niyet["ad"])
+            for ifade in niyet.get("sehirle", []):
+                self.ifadeler[niyet_normalize(ifade)] = (niyet["oncelik"], False, niyet["ad"])
+            for ifade in niyet["ifadeler"]:
+                # Çevreleyen boşluklar kelime sınırını otomatın içine taşır.
+                self.ifadeler[niyet_normalize(ifade)] = kayit
+            for ifade in niyet.get("tam", []):
+                self.tam[niyet_normalize(ifade)] = kayit
+        self.otomat = AhoCorasick(sorted(self.ifadeler))
+
+    def coz(self, mesaj: str) -> tuple[str, dict] | None:
+        """(niyet, slotlar) ya da None.
+
+        Slotlar: "gun" (hava ifadesine bitişik gün sayısı), "sehir_sart"
+        (yalnızca şehirle birlikte geçerli bir ifade eşleşti).
+        """
+        metin = niyet_normalize(mesaj)
+        en_iyi = self.tam.get(metin)
+        for ifade in self.otomat.hepsi(metin):
+            aday = self.ifadeler[ifade]
+            if en_iyi is None or aday[:2] > en_iyi[:2]:
+                en_iyi = aday
+        if en_iyi is None:
+            return None
+
+        slotlar = {}
+        if not en_iyi[1]:
+            slotlar["sehir_sart"] = True
+        gun = _GUN_KALIBI.search(metin)
+        if gun:
+            slotlar["gun"] = int(gun.group(1) or gun.group(2))
+        return en_iyi[2], slotlar
+
+
+@st.cache_resource(show_spinner=False)
+def get_niyet_yonlendirici() -> NiyetYonlendirici:
+    return NiyetYonlendirici(NIYETLER)
+
+
+def niyet_yaniti(user_message: str) -> str | None:
+    """Kimlik/saat/hava niyetlerini yerel olarak yanıtlar; diğerleri LLM'e kalır."""
+    cozum = get_niyet_yonlendirici().coz(user_message)
+    if cozum is None:
+        return None
+    niyet, slotlar = cozum
+
+    if niyet == "kimlik":
+        return KIMLIK_YANITI
+    if niyet == "saat":
+        return get_time_answer()
+
+    city = extract_city_from_message(user_message)
+    if slotlar.get("sehir_sart") and city is None:
+        return None  # "hava" başka anlamda geçiyor; LLM yanıtlasın
+    city = city or WEATHER_DEFAULT_CITY
+    gun = slotlar.get("gun")
+    if niyet == "tahmin" or (gun and gun > 1):
+        yanit = get_weather_forecast_answer(city, max(1, min(gun or 7, TAHMIN_EN_FAZLA_GUN)))
+        if gun and gun > TAHMIN_EN_FAZLA_GUN:
+            yanit = (
+                f"ℹ️ En fazla {TAHMIN_EN_FAZLA_GUN} günlük tahmin verebiliyorum; "
+                f"{gun} gün yerine {TAHMIN_EN_FAZLA_GUN} günü gösteriyorum.\n\n{yanit}"
+            )
+        return yanit
+    return get_weather_answer(city)
+
+
+# Talimat metni değiştiğinde artır: eski önbellek yanıtları geçersiz olur.
+SISTEM_TALIMATI_SURUMU = 1
+
+
+def build_system_talimati():
+    zaman_bilgisi = turkce_zaman_getir()
+    return f"""
+    Senin adın **ALPTECH AI**.
+    ALPTECH AI ekibi tarafından geliştirilen, modern ve profesyonel bir yapay zeka asistansın.
+
+    Odak noktaların:
+    - Ürün görselleri üzerinde çalışma (arka plan kaldırma, sahne oluşturma, e-ticaret görselleri).
+    - E-ticaret odaklı metinler yazma (ürün açıklaması, kampanya metni, sosyal medya postu).
+    - Genel sorularda açıklayıcı, sade cevaplar verme.
+
+    Her zaman kendini "ALPTECH AI" olarak tanıt.
+    Seni kimin geliştirdiği sorulduğunda: "ALPTECH AI ekibi" de.
+    Mümkün olduğunca kısa ama net cevap ver; kullanıcı isterse detaya gir.
+    Sistem notu: Bu yanıtlar {zaman_bilgisi} tarihinde oluşturuluyor.
+    """
+
+
+# ---- Sohbet görsel eki ----
+def sohbet_gorseli_hazirla(ham: bytes, detay: str = "auto") -> dict:
+    """Yüklenen görseli bir kez hazırlar: EXIF yönü, modele uygun boyut, doğru MIME.
+
+    Dönen kayıt her turda olduğu gibi gönderilir: {"url": data URL, "detail",
+    "boyut", "bayt", "tokens"}. Görsel açılamazsa PIL hatası yükselir.
+    """
+    with izle("chat_image_prep", detay=detay, bayt_giris=len(ham)) as iz:
+        veri, resim, mime = _sohbet_gorseli_kodla(ham, detay)
+        iz["boyut"] = gorsel_boyutu(resim)
+        iz["bayt_cikis"] = len(veri)
+
+    if detay == "low":
+        tokens = 85
+    else:
+        karo = -(-resim.width // 512) * -(-resim.height // 512)
+        tokens = 85 + 170 * karo
+    return {
+        "url": f"data:{mime};base64,{base64.b64encode(veri).decode('ascii')}",
+        "detail": detay,
+        "boyut": resim.size,
+        "bayt": len(veri),
+        "tokens": tokens,
+    }
+
+
+def _sohbet_gorseli_kodla(ham: bytes, detay: str) -> tuple[bytes, Image.Image, str]:
+    resim = ImageOps.exif_transpose(Image.open(BytesIO(ham)))
+    resim.load()
+    if detay == "low":
+        resim.thumbnail((512, 512), Image.Resampling.LANCZOS)
+    else:
+        # "high" ölçeklemesi: 2048 kareye sığdır, kısa kenarı 768'e indir.
+        resim.thumbnail((2048, 2048), Image.Resampling.LANCZOS)
+        kisa = min(resim.size)
+        if kisa > 768:
+            oran = 768 / kisa
+            resim = resim.resize(
+                (round(resim.width * oran), round(resim.height * oran)),
+                Image.Resampling.LANCZOS,
+            )
+
+    buf = BytesIO()
+    saydam = resim.mode in ("RGBA", "LA", "P") and resim.convert("RGBA").getextrema()[3][0] < 255
+    if saydam:
+        resim.convert("RGBA").save(buf, format="PNG", optimize=True)
+        mime = "image/png"
+    else:
+        resim.convert("RGB").save(buf, format="JPEG", quality=85, optimize=True)
+        mime = "image/jpeg"
+    return buf.getvalue(), resim, mime
+
+
+# ---- Token bütçeli bağlam ----
+@st.cache_resource(show_spinner=False)
+def get_token_kodlayici():
+    """tiktoken kodlayıcısı; paket ya da kodlama dosyası yoksa None (kaba tahmin)."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(DEFAULT_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print("tiktoken yüklenemedi, tahmini sayım kullanılacak:", e)
+        return None
+
+
+def token_say(metin: str) -> int:
+    kodlayici = get_token_kodlayici()
+    if kodlayici is None:
+        return len(metin) // 4 + 1
+    return len(kodlayici.encode(metin, disallowed_special=()))
+
+
+def mesaj_tokeni(msg: dict) -> int:
+    """Mesajın token maliyeti; mesajın içinde saklanır, her turda yeniden sayılmaz."""
+    if msg.get("tokens") is None:
+        msg["tokens"] = token_say(msg["content"]) + 4  # rol/ayraç payı
+    return msg["tokens"]
+
+
+@st.cache_resource(show_spinner=False)
+def get_ozet_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="ozet")
+
+
+def _ozet_yaz(
+    client: OpenAI, model: str, kapsam: int, onceki: str, mesajlar: list[dict]
+) -> tuple[int, str | None]:
+    """Eski özet + bağlamdan düşen mesajlar → (kapsam, yeni özet). Arka planda çalışır (st.* yok)."""
+    dokum = "\n".join(
+        f"{'Kullanıcı' if m['role'] == 'user' else 'Asistan'}: {m['content']}" for m in mesajlar
+    )
+    try:
+        with izle("openai_summary", model=model, bayt_giris=len(dokum.encode())) as iz:
+            response = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "Bir sohbetin devam eden özetini tutuyorsun. Mevcut özeti yeni "
+                            "mesajlarla birleştirip tek bir güncel özet yaz. Ürün bilgileri, "
+                            "kullanıcı tercihleri, verilen kararlar ve açık kalan sorular "
+                            "korunsun. Kısa ve Türkçe yaz."
+                        ),
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Mevcut özet:\n{onceki or '(yok)'}\n\nYeni mesajlar:\n{dokum}",
+                    },
+                ],
+                temperature=0,
+                max_tokens=CHAT_SUMMARY_TOKENS,
+                timeout=HTTP_TIMEOUT * 3,
+            )
+            metin = response.choices[0].message.content
+            iz["bayt_cikis"] = len((metin or "").encode())
+        return kapsam, metin
+    except Exception as e:
+        print("Özet HATA:", e)
+        return kapsam, None
 
-def sahne_olustur(client: OpenAI, urun_resmi: Image.Image, prompt_text: str):
+
+def ozetlenecek_mesajlar(oturum: str, bas: int, son: int) -> list[dict]:
+    """Özetin henüz kapsamadığı [bas, son) mesajları; bellekte olmayanlar depodan okunur.
+
+    Tek işte CHAT_CONTEXT_TOKENS kadarı gönderilir; kalan sonraki turlarda özetlenir.
+    """
+    try:
+        mesajlar = get_sohbet_deposu().mesaj_araligi(oturum, bas, son, limit=CHAT_PAGE_SIZE)
+    except Exception as e:
+        print("Sohbet deposu okuma hatası:", e)
+        mesajlar = []
+    if not mesajlar:  # depo yazılamamışsa elde olanla yetin
+        mesajlar = [dict(m) for m in st.session_state.chat_history if bas <= m["sira"] < son]
+    secilen, butce = [], CHAT_CONTEXT_TOKENS
+    for m in mesajlar:
+        butce -= mesaj_tokeni(m)
+        if butce < 0 and secilen:
+            break
+        secilen.append(m)
+    return secilen
+
+
+def sohbet_ozeti(oturum: str) -> dict:
+    """Oturumun özet kaydı: {"kapsam", "metin", "is"}; sira < kapsam olan mesajlar özetlenmiştir.
+
+    Tamamlanmış arka plan özet işi varsa önce sonucu devralınır ve depoya yazılır.
+    """
+    ozet = st.session_state.sohbet_ozetleri.get(oturum)
+    if ozet is None:
+        kayit = get_sohbet_deposu().oturum(oturum) or {}
+        ozet = {"kapsam": kayit.get("ozet_kapsam", 0), "metin": kayit.get("ozet", ""), "is": None}
+        st.session_state.sohbet_ozetleri[oturum] = ozet
+    is_ = ozet["is"]
+    if is_ is not None and is_.done():
+        ozet["is"] = None
+        kapsam, metin = is_.result()
+        if metin:
+            ozet["kapsam"], ozet["metin"] = kapsam, metin
+            get_sohbet_deposu().ozet_kaydet(oturum, kapsam, metin)
+    return ozet
+
+
+# ---- Belge ekleri (PDF/TXT) ----
+def belge_sayfalari(dosya_adi: str, ham: bytes):
+    """Belgeyi sayfa sayfa (sayfa_no, metin) olarak üretir; tüm metin bellekte birikmez."""
+    if dosya_adi.lower().endswith(".pdf"):
+        if PdfReader is None:
+            raise RuntimeError("PDF desteği için 'pypdf' paketi gerekli.")
+        for no, sayfa in enumerate(PdfReader(BytesIO(ham)).pages, start=1):
+            yield no, sayfa.extract_text() or ""
+        return
+    for kodlama in ("utf-8-sig", "cp1254"):
+        try:
+            metin = ham.decode(kodlama)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        metin = ham.decode("utf-8", errors="replace")
+    # Form feed (\f) sayfa ayırıcı kabul edilir.
+    for no, sayfa in enumerate(metin.split("\f"), start=1):
+        yield no, sayfa
+
+
+def belge_parcala(sayfalar, kelime: int = DOC_CHUNK_WORDS, ortusme: int = 30):
+    """Sayfa akışını ~kelime uzunluğunda, örtüşmeli parçalara böler: (sayfa etiketi, metin)."""
+    tampon: list[str] = []
+    tampon_sayfa: list[int] = []  # her kelimenin geldiği sayfa
+    for no, metin in sayfalar:
+        kelimeler = metin.split()
+        tampon.extend(kelimeler)
+        tampon_sayfa.extend([no] * len(kelimeler))
+        while len(tampon) >= kelime:
+            yield _sayfa_etiketi(tampon_sayfa[0], tampon_sayfa[kelime - 1]), " ".join(tampon[:kelime])
+            del tampon[: kelime - ortusme], tampon_sayfa[: kelime - ortusme]
+    if tampon:
+        yield _sayfa_etiketi(tampon_sayfa[0], tampon_sayfa[-1]), " ".join(tampon)
+
+
+def _sayfa_etiketi(ilk: int, son: int) -> str:
+    return str(ilk) if ilk == son else f"{ilk}–{son}"
+
+
+def belge_terimleri(metin: str) -> list[str]:
+    """BM25 terimleri: katlanmış kelimelerin ilk 5 harfi (Türkçe ekler için kaba kök)."""
+    return [k[:5] for k in re.findall(r"[a-z0-9]+", tr_kucuk(metin).translate(_TR_KATLAMA))]
+
+
+class BM25Dizin:
+    """Oturuma özel, artımlı doldurulan sözcüksel (BM25) belge dizini."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.parcalar: list[dict] = []
+        self.ters: dict[str, list[tuple[int, int]]] = {}
+        self.toplam_uzunluk = 0
+        self.ozetler: set[str] = set()  # yüklenmiş dosyaların içerik özetleri
+
+    def ekle(self, dosya: str, sayfa: str, metin: str):
+        terimler = belge_terimleri(metin)
+        if not terimler:
+            return
+        sira = len(self.parcalar)
+        self.parcalar.append(
+            {"dosya": dosya, "sayfa": sayfa, "metin": metin, "uzunluk": len(terimler)}
+        )
+        self.toplam_uzunluk += len(terimler)
+        for terim, adet in Counter(terimler).items():
+            self.ters.setdefault(terim, []).append((sira, adet))
+
+    def ara(self, sorgu: str, k: int = DOC_TOP_K) -> list[dict]:
+        n = len(self.parcalar)
+        if not n:
+            return []
+        ort = self.toplam_uzunluk / n
+        puanlar: dict[int, float] = {}
+        for terim in set(belge_terimleri(sorgu)):
+            liste = self.ters.get(terim)
+            if not liste:
+                continue
+            idf = np.log(1 + (n - len(liste) + 0.5) / (len(liste) + 0.5))
+            for sira, tf in liste:
+                uzunluk = self.parcalar[sira]["uzunluk"]
+                puanlar[sira] = puanlar.get(sira, 0.0) + idf * tf * (self.k1 + 1) / (
+                    tf + self.k1 * (1 - self.b + self.b * uzunluk / ort)
+                )
+        en_iyiler = sorted(puanlar, key=puanlar.get, reverse=True)[:k]
+        return [self.parcalar[sira] for sira in en_iyiler]
+
+
+def belge_ozeti(ham: bytes) -> str:
+    return hashlib.sha1(ham).hexdigest()
+
+
+def belge_yukle(dosya_adi: str, ham: bytes, ilerleme=None) -> int:
+    """Belgeyi oturumun dizinine ekler; eklenen parça sayısını döner (aynı dosya tekrar eklenmez).
+
+    Parçalar önce yerel listede toplanır; okuma yarıda hata verirse dizin
+    ve özet kümesi değişmez, dosya yeniden denenebilir.
+    """
+    dizin = st.session_state.belge_dizini
+    ozet = belge_ozeti(ham)
+    if ozet in dizin.ozetler:
+        return 0
+    parcalar = []
+    for sayfa, metin in belge_parcala(belge_sayfalari(dosya_adi, ham)):
+        parcalar.append((sayfa, metin))
+        if ilerleme is not None:
+            ilerleme(sayfa)
+    once = len(dizin.parcalar)
+    for sayfa, metin in parcalar:
+        dizin.ekle(dosya_adi, sayfa, metin)
+    eklenen = len(dizin.parcalar) - once
+    if eklenen:
+        dizin.ozetler.add(ozet)
+    return eklenen
+
+
+def belge_baglami(sorgu: str, butce: int) -> str | None:
+    """Sorguyla en ilgili belge parçaları (token bütçesi içinde) tek sistem notu olarak."""
+    dizin = st.session_state.get("belge_dizini")
+    if dizin is None or not dizin.parcalar:
+        return None
+    bolumler = []
+    for parca in dizin.ara(sorgu):
+        bolum = f"[{parca['dosya']}, s. {parca['sayfa']}]\n{parca['metin']}"
+        maliyet = token_say(bolum)
+        if maliyet > butce:
+            break
+        butce -= maliyet
+        bolumler.append(bolum)
+    if not bolumler:
+        return None
+    return (
+        "Kullanıcının yüklediği belgelerden bu soruyla ilgili bölümler "
+        "(yanıtı bunlara dayandır, gerekirse dosya ve sayfa belirt):\n\n" + "\n\n".join(bolumler)
+    )
+
+
+def sohbet_mesajlari(client: OpenAI) -> list[dict]:
+    """CHAT_CONTEXT_TOKENS bütçesini en yeni mesajdan geriye doğru doldurur.
+
+    Bütçeye sığmayan eski turlar oturumun devam eden özetiyle temsil edilir;
+    özet, arka planda ve yalnızca yeni düşen mesajlar için güncellenir.
+    """
+    system_talimati = build_system_talimati()
+    gecmis = st.session_state.chat_history
+    ozet = sohbet_ozeti(st.session_state.current_session)
+
+    gorsel = st.session_state.get("chat_image")
+    kalan = CHAT_CONTEXT_TOKENS - token_say(system_talimati)
+    if gorsel is not None:
+        kalan -= gorsel["tokens"]
+    son_soru = next((m["content"] for m in reversed(gecmis) if m["role"] == "user"), "")
+    belge_notu = belge_baglami(son_soru, min(CHAT_DOC_TOKENS, kalan // 2))
+    if belge_notu:
+        kalan -= token_say(belge_notu) + 4
+    if ozet["metin"]:
+        kalan -= token_say(ozet["metin"]) + 4
+    baslangic = len(gecmis)
+    while baslangic > 0:
+        maliyet = mesaj_tokeni(gecmis[baslangic - 1])
+        # Son mesaj bütçeyi tek başına aşsa bile gönderilir.
+        if maliyet > kalan and baslangic < len(gecmis):
+            break
+        kalan -= maliyet
+        baslangic -= 1
+
+    messages = [{"role": "system", "content": system_talimati}]
+    # Pencerenin gerisinde (bellekte ya da yalnızca depoda) mesaj varsa özet devreye girer.
+    if baslangic < len(gecmis) and gecmis[baslangic]["sira"] > 0:
+        if ozet["metin"]:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": f"Konuşmanın önceki kısmının özeti:\n{ozet['metin']}",
+                }
+            )
+            while baslangic < len(gecmis) - 1 and gecmis[baslangic]["sira"] < ozet["kapsam"]:
+                baslangic += 1
+        # Özetin gerisinde kalan her şey (yalnızca depoda olanlar dahil) özetlenir.
+        if ozet["is"] is None and gecmis[baslangic]["sira"] > ozet["kapsam"]:
+            bekleyen = ozetlenecek_mesajlar(
+                st.session_state.current_session, ozet["kapsam"], gecmis[baslangic]["sira"]
+            )
+            if bekleyen:
+                ozet["is"] = get_ozet_executor().submit(
+                    _ozet_yaz,
+                    client,
+                    st.secrets.get("OPENAI_MODEL", DEFAULT_MODEL),
+                    bekleyen[-1]["sira"] + 1,
+                    ozet["metin"],
+                    bekleyen,
+                )
+    if belge_notu:
+        messages.append({"role": "system", "content": belge_notu})
+    history_slice = gecmis[baslangic:]
+
+    for i, msg in enumerate(history_slice):
+        api_role = "user" if msg["role"] == "user" else "assistant"
+        if api_role == "user":
+            if i == len(history_slice) - 1 and gorsel is not None:
+                content = [
+                    {"type": "text", "text": msg["content"]},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": gorsel["url"], "detail": gorsel["detail"]},
+                    },
+                ]
+                messages.append({"role": "user", "content": content})
+            else:
+                messages.append({"role": "user", "content": msg["content"]})
+        else:
+            messages.append({"role": "assistant", "content": msg["content"]})
+
+    return messages
+
+
+def normal_sohbet(client: OpenAI):
+    """Model yanıtını geldikçe parça parça üretir (stream).
+
+    Tüketici üreteci kapattığında (yeni mesajla kesilen tur) HTTP akışı da kapanır.
+    """
+    messages = sohbet_mesajlari(client)
+    model_to_use = st.secrets.get("OPENAI_MODEL", DEFAULT_MODEL)
+
+    # İlk sistem mesajı dakikalık saat taşır; anahtara onun yerine talimat sürümü
+    # ve günün tarihi girer.
+    onbellek = yanit_onbellegi() if st.session_state.get("llm_onbellek", True) else None
+    anahtar = None
+    if onbellek is not None:
+        anahtar = onbellek.anahtar(
+            model_to_use, messages[1:], fetch_tr_time().date().isoformat()
+        )
+        try:
+            kayitli = onbellek.getir(anahtar)
+        except sqlite3.Error as e:
+            print("yanıt önbelleği okunamadı:", e)
+            onbellek = anahtar = kayitli = None
+        if kayitli is not None:
+            yield kayitli
+            return
+
+    # İz, akış bitene (ya da tüketici kesene) kadar açık kalır.
+    with izle("openai_chat", model=model_to_use, mesaj_sayisi=len(messages)) as iz:
+        baslangic = time.perf_counter()
+        try:
+            stream = client.chat.completions.create(
+                model=model_to_use,
+                messages=messages,
+                temperature=0.2,
+                max_tokens=1200,
+                stream=True,
+                timeout=istek_zaman_asimi(CHAT_TURN_BUDGET),
+            )
+        except Exception as e:
+            tb = traceback.format_exc()
+            iz["hata"] = type(e).__name__
+            st.error("⚠️ Sohbet API çağrısında hata. Konsolu kontrol et.")
+            print("Chat API HATA:", e, tb)
+            yield "Üzgünüm, sohbet hizmetinde şu an bir sorun var."
+            return
+
+        parcalar = []
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                parca = chunk.choices[0].delta.content
+                if parca:
+                    if not parcalar:
+                        iz["ilk_parca_ms"] = round((time.perf_counter() - baslangic) * 1000, 1)
+                    parcalar.append(parca)
+                    yield parca
+                kalan = tur_kalan_sure()
+                if kalan is not None and kalan <= 0:
+                    yield "\n\n_(Süre sınırı nedeniyle yanıt kısaltıldı.)_"
+                    break
+            else:
+                # Yalnızca eksiksiz tamamlanan yanıtlar saklanır.
+                if anahtar is not None and parcalar:
+                    try:
+                        onbellek.koy(anahtar, "".join(parcalar))
+                    except sqlite3.Error as e:
+                        print("yanıt önbelleğine yazılamadı:", e)
+        except Exception as e:
+            iz["hata"] = type(e).__name__
+            print("Chat stream HATA:", e, traceback.format_exc())
+            yield "\n\n_(Bağlantı sorunu nedeniyle yanıt yarıda kaldı.)_"
+        finally:
+            stream.close()
+            iz["bayt_cikis"] = sum(len(p.encode()) for p in parcalar)
+
+
+def sohbet_yanitini_yaz(client: OpenAI) -> str:
+    """Yanıtı asistan balonunda akıtır ve geçmişe ekler.
+
+    Kullanıcı yeni mesaj gönderip turu keserse eldeki kısmi metin yine kaydedilir.
+    Çıktı akarken moderasyon filtresinden artımlı geçirilir.
+    """
+    yer = st.empty()
+    yer.markdown("ALPTECH yazıyor... ▌")
+    denetim = ModerasyonAkisi(moderasyon_otomati())
+    akis = normal_sohbet(client)
+    parcalar: list[str] = []
+    baslangic = time.perf_counter()
+    son_cizim = 0.0
+    tamamlandi = False
+    try:
+        for parca in akis:
+            if not parcalar:
+                st.session_state.analytics["ilk_token_ms"] = round(
+                    (time.perf_counter() - baslangic) * 1000
+                )
+            parcalar.append(parca)
+            if denetim.besle(parca):
+                parcalar = [MODERASYON_RET_MESAJI]
+                break
+            simdi = time.perf_counter()
+            if simdi - son_cizim >= 0.05:  # her token için yeniden çizme
+                yer.markdown("".join(parcalar) + " ▌")
+                son_cizim = simdi
+        else:
+            if denetim.bitir():
+                parcalar = [MODERASYON_RET_MESAJI]
+        tamamlandi = True
+    finally:
+        akis.close()
+        cevap = "".join(parcalar)
+        if cevap and not tamamlandi:
+            cevap += " …"
+        if cevap:
+            mesaj_ekle("assistant", cevap)
+    yer.markdown(cevap)
+    return cevap
+
+# ===========================
+# GÖRSEL İŞLEME
+# ===========================
+def rembg_modulu():
+    """rembg'yi ilk kullanımda içe aktarır; yalnızca sohbet kullanan süreçler bu maliyeti ödemez."""
+    import rembg
+
+    return rembg
+
+
+class StudyoIsinmasi:
+    """Segmentasyon modelini arka planda yükleyip sahte bir çıkarımla ısıtır."""
+
+    def __init__(self):
+        self.durum = "kapalı"
+        self.sure: float | None = None
+        self.hata: str | None = None
+        if STUDIO_WARMUP:
+            self.durum = "ısınıyor"
+            threading.Thread(target=self._calistir, daemon=True, name="studyo-isinma").start()
+
+    @property
+    def hazir(self) -> bool:
+        return self.durum == "hazır"
+
+    def _calistir(self):
+        baslangic = time.perf_counter()
+        try:
+            rembg_modulu().remove(
+                Image.new("RGB", (64, 64), (255, 255, 255)),
+                session=get_segmentation_session(),
+                only_mask=True,
+            )
+            self.durum = "hazır"
+        except Exception as e:
+            print("Stüdyo ısınma hatası:", e)
+            self.hata = str(e)
+            self.durum = "hata"
+        self.sure = time.perf_counter() - baslangic
+
+
+@st.cache_resource(show_spinner=False)
+def get_studyo_isinmasi() -> StudyoIsinmasi:
+    return StudyoIsinmasi()
+
+
+@st.cache_resource(show_spinner=False)
+def get_segmentation_session():
+    """Process genelinde tek rembg/ONNX oturumu; tüm Streamlit oturumları paylaşır.
+
+    Thread sayısı yalnızca bu oturumun SessionOptions'ına yazılır; süreç geneli
+    OMP_NUM_THREADS'e dokunulmaz (NumPy/OpenMP kullanan diğer kodu etkilerdi).
+    """
+    rembg = rembg_modulu()
+    import onnxruntime
+
+    secenekler = onnxruntime.SessionOptions()
+    if REMBG_THREADS > 0:
+        secenekler.intra_op_num_threads = REMBG_THREADS
+        secenekler.inter_op_num_threads = REMBG_THREADS
+    return rembg.new_session(REMBG_MODEL, sess_opts=secenekler, providers=REMBG_PROVIDERS)
+
+
+class MatteCache:
+    """Kesilmiş ürün görselleri için bayt sınırlı, thread-safe LRU önbellek."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[str, tuple[Image.Image, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Image.Image | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0].copy()
+
+    def put(self, key: str, image: Image.Image):
+        boyut = image.width * image.height * len(image.getbands())
+        if boyut > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            self._items[key] = (image.copy(), boyut)
+            self.current_bytes += boyut
+            while self.current_bytes > self.max_bytes and self._items:
+                _, (_, eski_boyut) = self._items.popitem(last=False)
+                self.current_bytes -= eski_boyut
+
+
+@st.cache_resource(show_spinner=False)
+def get_matte_cache() -> MatteCache:
+    return MatteCache(MATTE_CACHE_MB * 1024 * 1024)
+
+
+def matte_anahtari(urun_resmi: Image.Image, *params) -> str:
+    """Çözülmüş piksel verisi + matting parametrelerinden içerik adresi üretir."""
+    h = hashlib.sha256()
+    h.update(f"{urun_resmi.mode}|{urun_resmi.size}|{REMBG_MODEL}|{params}".encode("utf-8"))
+    h.update(urun_resmi.tobytes())
+    return h.hexdigest()
+
+
+def _kutu_ortalama(x: np.ndarray, r: int) -> np.ndarray:
+    """(2r+1)x(2r+1) pencereli ortalama filtre; integral görüntü ile O(1)/piksel."""
+    h, w = x.shape
+    integral = np.zeros((h + 1, w + 1), dtype=np.float64)
+    np.cumsum(np.cumsum(x, axis=0), axis=1, out=integral[1:, 1:])
+    y0 = np.clip(np.arange(h) - r, 0, h)
+    y1 = np.clip(np.arange(h) + r + 1, 0, h)
+    x0 = np.clip(np.arange(w) - r, 0, w)
+    x1 = np.clip(np.arange(w) + r + 1, 0, w)
+    toplam = (
+        integral[y1][:, x1]
+        - integral[y0][:, x1]
+        - integral[y1][:, x0]
+        + integral[y0][:, x0]
+    )
+    adet = (y1 - y0)[:, None] * (x1 - x0)[None, :]
+    return toplam / adet
+
+
+def _buyut(x: np.ndarray, boyut: tuple[int, int]) -> np.ndarray:
+    return np.asarray(
+        Image.fromarray(x.astype(np.float32), mode="F").resize(boyut, Image.Resampling.BILINEAR)
+    )
+
+
+def hizli_matte(urun_resmi: Image.Image, maske: Image.Image) -> Image.Image:
+    """Ham model maskesini kenar duyarlı (fast guided filter) yöntemle iyileştirir.
+
+    Trimap ve filtre katsayıları küçültülmüş görüntüde hesaplanır, katsayılar tam
+    çözünürlüğe büyütülüp orijinal rehber görüntüye uygulanır.
+    """
+    tam_boyut = urun_resmi.size
+    oran = min(1.0, FAST_MATTE_SIDE / max(tam_boyut))
+    kucuk_boyut = (max(1, round(tam_boyut[0] * oran)), max(1, round(tam_boyut[1] * oran)))
+
+    rehber = np.asarray(urun_resmi.convert("L"), dtype=np.float32) / 255.0
+    rehber_k = np.asarray(
+        urun_resmi.convert("L").resize(kucuk_boyut, Image.Resampling.BILINEAR), dtype=np.float32
+    ) / 255.0
+    maske_k_img = maske.convert("L").resize(kucuk_boyut, Image.Resampling.BILINEAR)
+    maske_k = np.asarray(maske_k_img, dtype=np.float32) / 255.0
+
+    # Trimap: eşiklerin ötesi kesin ön/arka plan, sınır bandı aşındırma ile genişletilir.
+    asinma = 2 * max(1, round(10 * oran)) + 1
+    kesin_on = maske_k_img.point(lambda v: 255 if v >= MATTING_FG_THRESHOLD else 0)
+    kesin_arka = maske_k_img.point(lambda v: 255 if v <= MATTING_BG_THRESHOLD else 0)
+    kesin_on = kesin_on.filter(ImageFilter.MinFilter(asinma)).resize(tam_boyut, Image.Resampling.NEAREST)
+    kesin_arka = kesin_arka.filter(ImageFilter.MinFilter(asinma)).resize(tam_boyut, Image.Resampling.NEAREST)
+
+    r = FAST_MATTE_RADIUS
+    ort_i = _kutu_ortalama(rehber_k, r)
+    ort_p = _kutu_ortalama(maske_k, r)
+    kov_ip = _kutu_ortalama(rehber_k * maske_k, r) - ort_i * ort_p
+    var_i = _kutu_ortalama(rehber_k * rehber_k, r) - ort_i * ort_i
+    a = kov_ip / (var_i + FAST_MATTE_EPS)
+    b = ort_p - a * ort_i
+    a = _buyut(_kutu_ortalama(a, r), tam_boyut)
+    b = _buyut(_kutu_ortalama(b, r), tam_boyut)
+
+    alfa = np.clip(a * rehber + b, 0.0, 1.0)
+    alfa[np.asarray(kesin_on) > 0] = 1.0
+    alfa[np.asarray(kesin_arka) > 0] = 0.0
+    return Image.fromarray((alfa * 255.0 + 0.5).astype(np.uint8), mode="L")
+
+
+def _ham_maske(urun_resmi: Image.Image, onbellek: bool = True) -> Image.Image:
+    cache = get_matte_cache()
+    anahtar = matte_anahtari(urun_resmi, "mask")
+    maske = cache.get(anahtar) if onbellek else None
+    if maske is None:
+        with izle("rembg_remove", boyut=gorsel_boyutu(urun_resmi)):
+            maske = rembg_modulu().remove(
+                urun_resmi, session=get_segmentation_session(), only_mask=True
+            )
+        cache.put(anahtar, maske)
+    return maske
+
+
+def arka_plan_kaldir(
+    urun_resmi: Image.Image, kalite: str | None = None, onbellek: bool = True
+) -> Image.Image:
+    """Paylaşılan segmentasyon oturumu ile arka planı kaldırır.
+
+    kalite: "draft" (ham model maskesi), "fast" (kenar duyarlı hızlı iyileştirme)
+    veya "best" (pymatting ile closed-form alpha matting).
+    Aynı görsel + parametreler için sonuç önbellekten döner; preset değişimi
+    yalnızca yeniden kompozisyon yapar.
+    """
+    kalite = kalite if kalite in MATTE_TIERS else MATTE_DEFAULT_TIER
+    with izle("arka_plan_kaldir", kalite=kalite, boyut=gorsel_boyutu(urun_resmi)) as iz:
+        cache = get_matte_cache()
+        anahtar = matte_anahtari(
+            urun_resmi, kalite, MATTING_FG_THRESHOLD, MATTING_BG_THRESHOLD
+        )
+        temiz_urun = cache.get(anahtar) if onbellek else None
+        iz["onbellek"] = temiz_urun is not None
+        if temiz_urun is not None:
+            return temiz_urun
+
+        # Segmentasyon (rembg_remove) ve matting ayrı aşamalar olarak izlenir;
+        # ham maske tüm seviyelerde paylaşılan önbellekten gelir.
+        maske = _ham_maske(urun_resmi, onbellek)
+        temiz_urun = None
+        if kalite == "best":
+            with izle("matting", kalite=kalite):
+                try:
+                    temiz_urun = rembg_modulu().bg.alpha_matting_cutout(
+                        urun_resmi,
+                        maske,
+                        MATTING_FG_THRESHOLD,
+                        MATTING_BG_THRESHOLD,
+                        MATTING_ERODE_SIZE,
+                    )
+                except ValueError:
+                    pass  # çözülemeyen trimap: rembg gibi ham maskeye dön
+        elif kalite == "fast":
+            with izle("matting", kalite=kalite):
+                maske = hizli_matte(urun_resmi, maske)
+        if temiz_urun is None:
+            temiz_urun = urun_resmi.convert("RGBA")
+            temiz_urun.putalpha(maske)
+        cache.put(anahtar, temiz_urun)
+        return temiz_urun
+
+
+def matte_benchmark(urun_resmi: Image.Image, tekrar: int = 1) -> list[dict]:
+    """Her kalite seviyesi için gecikme ve "best"e göre kenar hatasını ölçer.
+
+    Kenar hatası, referans alfanın yarı saydam olduğu (ya da kesin sınırın
+    komşuluğundaki) bantta ortalama mutlak alfa farkıdır (0–1).
+    """
+    resim = urun_resmi.copy()
+    if resim.width > 1200 or resim.height > 1200:
+        resim.thumbnail((1200, 1200), Image.Resampling.LANCZOS)
+    _ham_maske(resim, onbellek=False)  # model ısınması ölçüme karışmasın
+
+    sureler: dict[str, float] = {}
+    alfalar: dict[str, np.ndarray] = {}
+    for kalite in MATTE_TIERS:
+        baslangic = time.perf_counter()
+        for _ in range(tekrar):
+            sonuc = arka_plan_kaldir(resim, kalite, onbellek=False)
+        sureler[kalite] = (time.perf_counter() - baslangic) * 1000 / tekrar
+        alfalar[kalite] = np.asarray(sonuc.split()[3], dtype=np.float32) / 255.0
+
+    referans = alfalar["best"]
+    ref_img = Image.fromarray((referans * 255).astype(np.uint8), mode="L")
+    bant = (
+        np.asarray(ref_img.filter(ImageFilter.MaxFilter(7)), dtype=np.int16)
+        - np.asarray(ref_img.filter(ImageFilter.MinFilter(7)), dtype=np.int16)
+    ) > 0
+    bant |= (referans > 0.02) & (referans < 0.98)
+    return [
+        {
+            "kalite": kalite,
+            "süre_ms": round(sureler[kalite], 1),
+            "kenar_hatası": round(float(np.abs(alfalar[kalite] - referans)[bant].mean()), 4)
+            if bant.any()
+            else 0.0,
+        }
+        for kalite in MATTE_TIERS
+    ]
+
+
+def resmi_hazirla(image: Image.Image):
+    with izle("resmi_hazirla", boyut=gorsel_boyutu(image)):
+        kare_resim = Image.new("RGBA", (1024, 1024), (0, 0, 0, 0))
+        image.thumbnail((850, 850), Image.Resampling.LANCZOS)
+        x = (1024 - image.width) // 2
+        y = (1024 - image.height) // 2
+        kare_resim.paste(image, (x, y), image if image.mode == "RGBA" else None)
+        return kare_resim
+
+
+def bayt_cevir(image: Image.Image):
+    with izle("bayt_cevir", boyut=gorsel_boyutu(image)) as iz:
+        buf = BytesIO()
+        image.save(buf, format="PNG")
+        iz["bayt_cikis"] = buf.tell()
+        return buf.getvalue()
+
+
+class SahneOnbellegi:
+    """Üretilmiş AI sahneleri için içerik adresli disk önbelleği (boyut sınırlı).
+
+    Dosyalar <dizin>/<ilk 2 hane>/<anahtar>.png olarak yazılır; sınır aşılınca
+    en uzun süredir kullanılmayanlar (mtime) silinir.
+    """
+
+    def __init__(self, dizin: str, azami_bayt: int):
+        self.dizin = dizin
+        self.azami_bayt = azami_bayt
+        self.isabet = 0
+        self.iska = 0
+        self._lock = threading.Lock()
+        os.makedirs(dizin, exist_ok=True)
+        self.toplam_bayt = sum(os.path.getsize(y) for y, _ in self._dosyalar())
+
+    def _dosyalar(self):
+        for kok, _, adlar in os.walk(self.dizin):
+            for ad in adlar:
+                if ad.endswith(".png"):
+                    yol = os.path.join(kok, ad)
+                    try:
+                        yield yol, os.path.getmtime(yol)
+                    except OSError:
+                        continue
+
+    def _yol(self, anahtar: str) -> str:
+        return os.path.join(self.dizin, anahtar[:2], f"{anahtar}.png")
+
+    def getir(self, anahtar: str) -> bytes | None:
+        yol = self._yol(anahtar)
+        try:
+            with open(yol, "rb") as f:
+                veri = f.read()
+            os.utime(yol)  # LRU için "son kullanım"
+        except OSError:
+            with self._lock:
+                self.iska += 1
+            return None
+        with self._lock:
+            self.isabet += 1
+        return veri
+
+    def koy(self, anahtar: str, veri: bytes) -> bool:
+        """Sonucu diske yazar; disk hatasında kaydı atlar (False) ve sonucu bozmaz."""
+        yol = self._yol(anahtar)
+        gecici = None
+        try:
+            os.makedirs(os.path.dirname(yol), exist_ok=True)
+            fd, gecici = tempfile.mkstemp(dir=os.path.dirname(yol), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(veri)
+            with self._lock:
+                try:
+                    self.toplam_bayt -= os.path.getsize(yol)
+                except OSError:
+                    pass
+                os.replace(gecici, yol)
+                gecici = None
+                self.toplam_bayt += len(veri)
+                if self.toplam_bayt > self.azami_bayt:
+                    self._budama()
+            return True
+        except OSError as e:
+            print("sahne önbelleğine yazılamadı:", e)
+            return False
+        finally:
+            if gecici is not None:
+                try:
+                    os.remove(gecici)
+                except OSError:
+                    pass
+
+    def _budama(self):
+        hedef = self.azami_bayt * 0.9
+        for yol, _ in sorted(self._dosyalar(), key=lambda d: d[1]):
+            if self.toplam_bayt <= hedef:
+                break
+            try:
+                boyut = os.path.getsize(yol)
+                os.remove(yol)
+                self.toplam_bayt -= boyut
+            except OSError:
+                continue
+
+
+@st.cache_resource(show_spinner=False)
+def get_sahne_onbellegi() -> SahneOnbellegi:
+    return SahneOnbellegi(SCENE_CACHE_DIR, SCENE_CACHE_MB * 1024 * 1024)
+
+
+def sahne_onbellegi() -> SahneOnbellegi | None:
+    """Sahne önbelleği; dizin oluşturulamıyorsa None (üretim önbelleksiz sürer)."""
+    try:
+        return get_sahne_onbellegi()
+    except OSError as e:
+        print("sahne önbelleği kullanılamıyor:", e)
+        return None
+
+
+def sahne_anahtari(hazir_urun: Image.Image, maske: Image.Image, prompt_text: str, boyut: str) -> str:
+    h = hashlib.sha256()
+    h.update(f"{hazir_urun.size}|{prompt_text}|{boyut}".encode("utf-8"))
+    h.update(hazir_urun.tobytes())
+    h.update(maske.tobytes())
+    return h.hexdigest()
+
+
+def sahne_olustur(
+    client: OpenAI,
+    urun_resmi: Image.Image,
+    prompt_text: str,
+    kalite: str | None = None,
+    yeni_varyasyon: bool = False,
+) -> bytes | None:
+    """AI ile sahne oluşturur; sonucu PNG bayt olarak döndürür (hata olursa None).
+
+    Aynı hazırlanmış görsel/maske/prompt/boyut için önceki sonuç diskten gelir;
+    yeni_varyasyon=True önbelleği atlayıp yeni üretimi kaydeder.
+    """
     if SABIT_API_KEY is None:
         return None
+    with izle("sahne_olustur", kalite=kalite, yeni_varyasyon=yeni_varyasyon) as iz:
+        sonuc = _sahne_uret(client, urun_resmi, prompt_text, kalite, yeni_varyasyon)
+        if sonuc is None:
+            iz["hata"] = "sonuc_yok"
+        else:
+            iz["bayt_cikis"] = len(sonuc)
+        return sonuc
+
+
+def _sahne_uret(
+    client: OpenAI,
+    urun_resmi: Image.Image,
+    prompt_text: str,
+    kalite: str | None,
+    yeni_varyasyon: bool,
+) -> bytes | None:
     try:
         max_boyut = 1200
         if urun_resmi.width > max_boyut or urun_resmi.height > max_boyut:
             urun_resmi.thumbnail((max_boyut, max_boyut), Image.Resampling.LANCZOS)
 
         try:
-            temiz_urun = remove(
-                urun_resmi,
-                alpha_matting=True,
-                alpha_matting_foreground_threshold=240,
-                alpha_matting_background_threshold=10,
-            )
+            temiz_urun = arka_plan_kaldir(urun_resmi, kalite)
         except Exception:
             temiz_urun = urun_resmi.convert("RGBA")
 
         hazir_urun = resmi_hazirla(temiz_urun)
         if hazir_urun.mode != "RGBA":
             hazir_urun = hazir_urun.convert("RGBA")
-        maske_ham = hazir_urun.split()[3]
-        maske_yumusak = maske_ham.filter(ImageFilter.GaussianBlur(radius=3))
-        final_maske = Image.new("RGBA", hazir_urun.size, (0, 0, 0, 0))
-        final_maske.putalpha(maske_yumusak)
-
-        response = client.images.edit(
-            image=("image.png", bayt_cevir(hazir_urun), "image/png"),
-            mask=("mask.png", bayt_cevir(final_maske), "image/png"),
-            prompt=prompt_text,
-            n=1,
-            size="1024x1024",
-        )
-        try:
-            return response.data[0].url
-        except Exception:
-            try:
-                return response["data"][0]["url"]
-            except Exception:
+        with izle("mask_blur", boyut=gorsel_boyutu(hazir_urun)):
+            maske_ham = hazir_urun.split()[3]
+            maske_yumusak = maske_ham.filter(ImageFilter.GaussianBlur(radius=3))
+            final_maske = Image.new("RGBA", hazir_urun.size, (0, 0, 0, 0))
+            final_maske.putalpha(maske_yumusak)
+
+        onbellek = sahne_onbellegi()
+        anahtar = sahne_anahtari(hazir_urun, final_maske, prompt_text, SCENE_SIZE)
+        if onbellek is not None and not yeni_varyasyon:
+            kayitli = onbellek.getir(anahtar)
+            if kayitli is not None:
+                return kayitli
+
+        urun_png, maske_png = bayt_cevir(hazir_urun), bayt_cevir(final_maske)
+        with izle(
+            "openai_images_edit", boyut=SCENE_SIZE, bayt_giris=len(urun_png) + len(maske_png)
+        ) as iz:
+            response = client.images.edit(
+                image=("image.png", urun_png, "image/png"),
+                mask=("mask.png", maske_png, "image/png"),
+                prompt=prompt_text,
+                n=1,
+                size=SCENE_SIZE,
+                response_format="b64_json",
+            )
+            # Sonuç yanıtın içinde gelir; ayrı bir URL indirmesi yapılmaz.
+            b64 = response.data[0].b64_json
+            if not b64:
+                iz["hata"] = "bos_yanit"
                 return None
+            sonuc = base64.b64decode(b64)
+            iz["bayt_cikis"] = len(sonuc)
     except Exception as e:
         print("sahne_olustur hata:", e, traceback.format_exc())
         return None
 
+    # Ücretli sonuç her durumda döner; önbellek yazımı yalnızca en iyi çaba.
+    if onbellek is not None:
+        onbellek.koy(anahtar, sonuc)
+    return sonuc
+
+
+# Yerel sahne presetleri: (gradyan durakları, yön, vinyet, gölge, yansıma)
+SAHNE_PRESETLERI = {
+    "ACTION_PASTEL": {
+        "duraklar": [(0.0, (252, 228, 236)), (0.5, (232, 224, 250)), (1.0, (212, 232, 252))],
+        "yon": "diagonal",
+        "vinyet": 0.08,
+        "golge": 0.30,
+        "yansima": 0.0,
+    },
+    "ACTION_SUNSET": {
+        "duraklar": [(0.0, (92, 62, 146)), (0.55, (238, 108, 128)), (1.0, (255, 188, 112))],
+        "yon": "vertical",
+        "vinyet": 0.18,
+        "golge": 0.40,
+        "yansima": 0.22,
+    },
+    "ACTION_GREY": {
+        "duraklar": [(0.0, (238, 238, 239)), (1.0, (196, 197, 200))],
+        "yon": "radial",
+        "vinyet": 0.22,
+        "golge": 0.45,
+        "yansima": 0.0,
+    },
+    "ACTION_CARD": {
+        "duraklar": [(0.0, (236, 237, 240)), (1.0, (255, 255, 255))],
+        "yon": "vertical",
+        "vinyet": 0.05,
+        "golge": 0.30,
+        "yansima": 0.18,
+    },
+}
+
+
+def _gradyan(boyut: int, duraklar: list, yon: str) -> np.ndarray:
+    eksen = np.linspace(0.0, 1.0, boyut, dtype=np.float32)
+    if yon == "vertical":
+        t = np.broadcast_to(eksen[:, None], (boyut, boyut))
+    elif yon == "diagonal":
+        t = (eksen[:, None] + eksen[None, :]) / 2.0
+    else:  # radial
+        t = np.sqrt((eksen[:, None] - 0.5) ** 2 + (eksen[None, :] - 0.5) ** 2) / np.sqrt(0.5)
+    konumlar = [d[0] for d in duraklar]
+    return np.stack(
+        [np.interp(t, konumlar, [d[1][k] for d in duraklar]) for k in range(3)], axis=-1
+    ).astype(np.float32) / 255.0
+
+
+def _alfa_karistir(zemin: np.ndarray, renk: np.ndarray, alfa: np.ndarray) -> np.ndarray:
+    alfa = alfa[..., None]
+    return zemin * (1.0 - alfa) + renk * alfa
 
-def yerel_islem(urun_resmi: Image.Image, islem_tipi: str):
+
+def sahne_render(temiz_urun: Image.Image, islem_tipi: str, boyut: int = 1024) -> Image.Image:
+    """Kesilmiş ürünü yerel, deterministik bir sahneye yerleştirir (OpenAI çağrısı yok).
+
+    Gradyan fon, vinyet, yumuşak temas gölgesi ve zemin yansıması NumPy ile
+    tek geçişte hesaplanır.
+    """
+    ayar = SAHNE_PRESETLERI[islem_tipi]
+    urun = temiz_urun.convert("RGBA")
+    kutu = urun.getchannel("A").getbbox()
+    if kutu:
+        urun = urun.crop(kutu)
+    urun.thumbnail((int(boyut * 0.72), int(boyut * 0.62)), Image.Resampling.LANCZOS)
+    w, h = urun.size
+    x0 = (boyut - w) // 2
+    taban = int(boyut * 0.80)  # ürünün zemine değdiği satır
+    y0 = taban - h
+
+    katman = np.zeros((boyut, boyut, 4), dtype=np.float32)
+    katman[y0:taban, x0 : x0 + w] = np.asarray(urun, dtype=np.float32) / 255.0
+    urun_rgb, urun_alfa = katman[..., :3], katman[..., 3]
+
+    sahne = _gradyan(boyut, ayar["duraklar"], ayar["yon"])
+
+    if ayar["vinyet"]:
+        eksen = np.linspace(-1.0, 1.0, boyut, dtype=np.float32)
+        r2 = (eksen[:, None] ** 2 + eksen[None, :] ** 2) / 2.0
+        sahne *= (1.0 - ayar["vinyet"] * r2)[..., None]
+
+    if ayar["yansima"]:
+        yukseklik = min(h, boyut - taban)
+        yansima = np.zeros_like(katman)
+        yansima[taban : taban + yukseklik] = katman[taban - 1 : taban - 1 - yukseklik : -1]
+        solma = np.zeros(boyut, dtype=np.float32)
+        solma[taban : taban + yukseklik] = ayar["yansima"] * np.linspace(
+            1.0, 0.0, yukseklik, dtype=np.float32
+        ) ** 1.5
+        sahne = _alfa_karistir(sahne, yansima[..., :3], yansima[..., 3] * solma[:, None])
+
+    if ayar["golge"]:
+        # Temas gölgesi: ürün siluetini tabana doğru basık bir elipse indir ve bulanıklaştır.
+        siluet = Image.fromarray((urun_alfa[y0:taban, x0 : x0 + w] * 255).astype(np.uint8), mode="L")
+        basik = siluet.resize((w, max(1, h // 10)), Image.Resampling.BILINEAR)
+        golge_img = Image.new("L", (boyut, boyut), 0)
+        golge_img.paste(basik, (x0, taban - basik.height // 2))
+        golge_img = golge_img.filter(ImageFilter.GaussianBlur(radius=boyut / 64))
+        golge = np.asarray(golge_img, dtype=np.float32) / 255.0 * ayar["golge"]
+        sahne = sahne * (1.0 - golge[..., None])
+
+    sahne = _alfa_karistir(sahne, urun_rgb, urun_alfa)
+    return Image.fromarray((np.clip(sahne, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8), mode="RGB")
+
+
+def yerel_islem(urun_resmi: Image.Image, islem_tipi: str, kalite: str | None = None):
+    with izle("yerel_islem", islem=islem_tipi, kalite=kalite):
+        return _yerel_islem(urun_resmi, islem_tipi, kalite)
+
+
+def _yerel_islem(urun_resmi: Image.Image, islem_tipi: str, kalite: str | None):
     max_boyut = 1200
     if urun_resmi.width > max_boyut or urun_resmi.height > max_boyut:
         urun_resmi.thumbnail((max_boyut, max_boyut), Image.Resampling.LANCZOS)
 
     try:
-        temiz_urun = remove(
-            urun_resmi,
-            alpha_matting=True,
-            alpha_matting_foreground_threshold=240,
-            alpha_matting_background_threshold=10,
-        )
+        temiz_urun = arka_plan_kaldir(urun_resmi, kalite)
     except Exception as e:
         print("rembg hata, orijinal resim kullanılıyor:", e)
         temiz_urun = urun_resmi
 
     if islem_tipi == "ACTION_TRANSPARENT":
         return temiz_urun
+    if islem_tipi in SAHNE_PRESETLERI:
+        return sahne_render(temiz_urun, islem_tipi)
     renkler = {
         "ACTION_WHITE": (255, 255, 255),
         "ACTION_BLACK": (0, 0, 0),
@@ -796,45 +3538,729 @@ def yerel_islem(urun_resmi: Image.Image, islem_tipi: str):
     bg.paste(temiz_urun, mask=temiz_urun if temiz_urun.mode in ("RGBA", "LA") else None)
     return bg
 
+
+def sonuc_kodla(sonuc: Image.Image, islem_tipi: str) -> tuple[bytes, str]:
+    """Yerel işlem sonucunu indirilebilir bayta çevirir (şeffafsa PNG, değilse JPEG)."""
+    fmt = "PNG" if islem_tipi == "ACTION_TRANSPARENT" else "JPEG"
+    with izle("sonuc_kodla", bicim=fmt, boyut=gorsel_boyutu(sonuc)) as iz:
+        buf = BytesIO()
+        sonuc.save(buf, format=fmt)
+        iz["bayt_cikis"] = buf.tell()
+        return buf.getvalue(), fmt
+
+
+def yukleme_iz_kimligi(kaynak) -> str:
+    """Yüklenen dosyaya sabit iz_id: açma ve işleme adımları tek izde toplanır."""
+    anahtar = getattr(kaynak, "file_id", None) or f"{kaynak.name}|{kaynak.size}"
+    return hashlib.sha1(anahtar.encode("utf-8")).hexdigest()[:16]
+
+
+def gorsel_ac(kaynak) -> Image.Image:
+    """Yüklenen dosyayı (UploadedFile ya da bayt) çözer, EXIF yönünü uygular; RGBA döner."""
+    ham = kaynak if isinstance(kaynak, bytes) else kaynak.getvalue()
+    with izle("upload_decode", bayt_giris=len(ham)) as iz:
+        resim = Image.open(BytesIO(ham))
+        resim.load()
+        iz["bicim"] = resim.format
+        iz["boyut"] = gorsel_boyutu(resim)
+    with izle("exif_transpose", boyut=gorsel_boyutu(resim)):
+        return ImageOps.exif_transpose(resim).convert("RGBA")
+
+
+def kalite_secici(key: str) -> str:
+    """Kesim (matting) kalite seviyesi seçimi; varsayılan MATTE_DEFAULT_TIER."""
+    tiers = list(MATTE_TIERS)
+    varsayilan = MATTE_DEFAULT_TIER if MATTE_DEFAULT_TIER in MATTE_TIERS else "best"
+    return st.selectbox(
+        "Kesim kalitesi:",
+        tiers,
+        index=tiers.index(varsayilan),
+        format_func=MATTE_TIERS.get,
+        key=key,
+    )
+
+
+# ===========================
+# TOPLU STÜDYO (ÇOKLU ÜRÜN)
+# ===========================
+STUDIO_WORKERS = int(st.secrets.get("STUDIO_WORKERS", min(4, os.cpu_count() or 1)))
+
+
+@st.cache_resource(show_spinner=False)
+def get_studio_executor() -> ThreadPoolExecutor:
+    """Tüm oturumların paylaştığı, sınırlı boyutlu görsel işleme havuzu."""
+    return ThreadPoolExecutor(max_workers=STUDIO_WORKERS, thread_name_prefix="studio")
+
+
+class TopluIs:
+    """Bir toplu stüdyo işi: dosya × preset kombinasyonlarını işleyip ZIP'e yazar."""
+
+    def __init__(
+        self, dosyalar: list[tuple[str, bytes]], presetler: list[str], kalite: str | None = None
+    ):
+        self.id = uuid.uuid4().hex
+        self.dosyalar = dosyalar
+        self.presetler = presetler
+        self.kalite = kalite
+        self.toplam = len(dosyalar) * len(presetler)
+        self.biten = 0
+        self.hatalar: list[str] = []
+        self.son_ogeler: list[str] = []
+        self.durum = "sırada"
+        self.olusturma = time.time()
+        self.bitis: float | None = None  # temizlik süresi bitişten sayılır
+        fd, self.zip_yolu = tempfile.mkstemp(prefix="alptech_toplu_", suffix=".zip")
+        os.close(fd)
+        self._lock = threading.Lock()
+
+    @property
+    def bitti(self) -> bool:
+        return self.durum in ("bitti", "hata")
+
+    def baslat(self):
+        threading.Thread(target=self._calistir, name=f"toplu-{self.id[:8]}", daemon=True).start()
+
+    @staticmethod
+    def _klasor_adlari(dosyalar: list[tuple[str, bytes]]) -> list[str]:
+        """Her yükleme için ZIP içinde benzersiz klasör adı (a.png + a.jpg → a, a_2)."""
+        adlar, kullanilan = [], set()
+        for dosya_adi, _ in dosyalar:
+            kok = os.path.splitext(os.path.basename(dosya_adi))[0] or "urun"
+            ad, n = kok, 1
+            while ad.lower() in kullanilan:
+                n += 1
+                ad = f"{kok}_{n}"
+            kullanilan.add(ad.lower())
+            adlar.append(ad)
+        return adlar
+
+    def _oge_isle(self, kok: str, veri: bytes, tema_adi: str) -> tuple[str, bytes]:
+        kod = TEMA_LISTESI[tema_adi]
+        etiket = re.sub(r"[^\w]+", "_", tema_adi).strip("_").lower() or "preset"
+        with izle("studio_run", kaynak="toplu", is_id=self.id, islem=kod) as iz:
+            resim = gorsel_ac(veri)
+            if kod.startswith("ACTION_"):
+                cikti, fmt = sonuc_kodla(yerel_islem(resim, kod, self.kalite), kod)
+            else:
+                if SABIT_API_KEY is None:
+                    raise RuntimeError("OPENAI_API_KEY tanımlı değil")
+                cikti = sahne_olustur(get_openai_client(), resim, kod, self.kalite)
+                if not cikti:
+                    raise RuntimeError("AI sahne oluşturulamadı")
+                fmt = "PNG"
+            iz["bayt_cikis"] = len(cikti)
+        return f"{kok}/{etiket}.{fmt.lower()}", cikti
+
+    def _calistir(self):
+        self.durum = "çalışıyor"
+        executor = get_studio_executor()
+        klasorler = self._klasor_adlari(self.dosyalar)
+        isler = iter(
+            [
+                (ad, klasor, veri, tema)
+                for (ad, veri), klasor in zip(self.dosyalar, klasorler)
+                for tema in self.presetler
+            ]
+        )
+        pencere = STUDIO_WORKERS * 2
+        bekleyen: dict = {}
+        try:
+            with zipfile.ZipFile(self.zip_yolu, "w", compression=zipfile.ZIP_STORED) as zf:
+                while True:
+                    # Bellekte aynı anda en fazla `pencere` kadar sonuç tutulur.
+                    while len(bekleyen) < pencere:
+                        oge = next(isler, None)
+                        if oge is None:
+                            break
+                        bekleyen[executor.submit(self._oge_isle, *oge[1:])] = oge
+                    if not bekleyen:
+                        break
+                    tamamlanan, _ = wait(bekleyen, return_when=FIRST_COMPLETED)
+                    for fut in tamamlanan:
+                        ad, _, _, tema = bekleyen.pop(fut)
+                        try:
+                            arsiv_adi, cikti = fut.result()
+                            zf.writestr(arsiv_adi, cikti)
+                            satir = f"✅ {ad} · {tema}"
+                        except Exception as e:
+                            print("toplu işlem hata:", ad, tema, e, traceback.format_exc())
+                            satir = f"❌ {ad} · {tema}: {e}"
+                            with self._lock:
+                                self.hatalar.append(satir)
+                        with self._lock:
+                            self.biten += 1
+                            self.son_ogeler = (self.son_ogeler + [satir])[-8:]
+            self.dosyalar = []
+            self.bitis = time.time()
+            self.durum = "bitti"
+        except Exception as e:
+            print("toplu iş hata:", e, traceback.format_exc())
+            self.bitis = time.time()
+            self.durum = "hata"
+
+    def temizle(self):
+        try:
+            os.remove(self.zip_yolu)
+        except OSError:
+            pass
+
+
+@st.cache_resource(show_spinner=False)
+def get_toplu_isler() -> dict[str, TopluIs]:
+    return {}
+
+
+def toplu_is_baslat(
+    dosyalar: list[tuple[str, bytes]], presetler: list[str], kalite: str | None = None
+) -> str:
+    isler = get_toplu_isler()
+    # Bir saattir indirilmeyi bekleyen bitmiş işlerin ZIP dosyalarını temizle.
+    for is_id, eski in list(isler.items()):
+        if eski.bitti and time.time() - eski.bitis > 3600:
+            eski.temizle()
+            isler.pop(is_id, None)
+    yeni = TopluIs(dosyalar, presetler, kalite)
+    isler[yeni.id] = yeni
+    yeni.baslat()
+    return yeni.id
+
+
+def _dosya_oku(yol: str) -> bytes:
+    with open(yol, "rb") as f:
+        return f.read()
+
+
+def _toplu_is_durumu():
+    is_ = get_toplu_isler().get(st.session_state.get("toplu_is_id"))
+    if is_ is None:
+        return
+    oran = is_.biten / is_.toplam if is_.toplam else 1.0
+    st.progress(oran, text=f"{is_.biten}/{is_.toplam} görsel işlendi ({is_.durum})")
+    for satir in is_.son_ogeler:
+        st.caption(satir)
+
+    if not is_.bitti:
+        return
+    if is_.durum == "hata":
+        st.error("Toplu işlem yarıda kaldı. Lütfen tekrar dene.")
+    elif is_.hatalar:
+        st.warning(f"{len(is_.hatalar)} görsel işlenemedi; diğerleri ZIP içinde.")
+    if is_.biten > len(is_.hatalar) and os.path.exists(is_.zip_yolu):
+        # ZIP her rerun'da belleğe okunmaz; dosya yalnızca indirme tıklanınca okunur.
+        st.download_button(
+            label="📦 Tümünü İndir (ZIP)",
+            data=functools.partial(_dosya_oku, is_.zip_yolu),
+            file_name="alptech_toplu.zip",
+            mime="application/zip",
+            use_container_width=True,
+        )
+    if st.session_state.get("toplu_is_canli"):
+        # Polling'i durdurmak için tam bir rerun ile paneli statik çiz.
+        st.session_state.toplu_is_canli = False
+        st.rerun()
+
+
+def toplu_studyo_ui():
+    st.markdown("#### Ürün görsellerini yükle (toplu)")
+    dosyalar = st.file_uploader(
+        "Ürün fotoğrafları",
+        type=["png", "jpg", "jpeg", "webp"],
+        accept_multiple_files=True,
+        label_visibility="collapsed",
+        key="studio_batch_upload",
+    )
+    presetler = st.multiselect(
+        "Uygulanacak preset(ler):",
+        list(TEMA_LISTESI.keys()),
+        default=["⬜ Saf Beyaz Fon (E-ticaret)"],
+        key="studio_batch_presets",
+    )
+    kalite = kalite_secici("studio_batch_quality")
+    ai_secili = [p for p in presetler if not TEMA_LISTESI[p].startswith("ACTION_")]
+    if ai_secili and SABIT_API_KEY is None:
+        st.warning("AI sahne presetleri için OPENAI_API_KEY gerekli; bu presetler hata verecek.")
+
+    mevcut = get_toplu_isler().get(st.session_state.get("toplu_is_id"))
+    calisiyor = mevcut is not None and not mevcut.bitti
+
+    if st.button(
+        f"🚀 Toplu İşlemi Başlat ({len(dosyalar or []) * len(presetler)} görsel)",
+        type="primary",
+        disabled=calisiyor or not dosyalar or not presetler,
+    ):
+        if mevcut is not None:
+            mevcut.temizle()
+        girdiler = [(d.name, d.getvalue()) for d in dosyalar]
+        st.session_state.toplu_is_id = toplu_is_baslat(girdiler, presetler, kalite)
+        st.session_state.toplu_is_canli = True
+        inc_stat("studio_runs", len(girdiler) * len(presetler))
+        inc_stat("uploads", len(girdiler))
+        calisiyor = True
+
+    st.fragment(_toplu_is_durumu, run_every=1.0 if calisiyor else None)()
+
+
+# ===========================
+# AI SAHNE İŞLERİ (ARKA PLAN)
+# ===========================
+class SahneIsi:
+    """Arka planda çalışan tek bir AI sahne üretimi; sonucu PNG bayt olarak tutar."""
+
+    def __init__(
+        self,
+        anahtar: str,
+        urun_resmi: Image.Image,
+        prompt_text: str,
+        kalite: str | None,
+        yeni_varyasyon: bool = False,
+        iz_id: str | None = None,
+        sahip: str = "",
+    ):
+        self.id = uuid.uuid4().hex
+        self.iz_id = iz_id
+        self.sahip = sahip  # işi başlatanın kullanici_kimligi(); URL'deki id tek başına yetmez
+        self.anahtar = anahtar
+        self.durum = "sırada"
+        self.asama = "Sırada bekliyor"
+        self.sonuc: bytes | None = None
+        self.hata: str | None = None
+        self.olusturma = time.time()
+        self._girdi = (urun_resmi, prompt_text, kalite, yeni_varyasyon)
+
+    @property
+    def bitti(self) -> bool:
+        return self.durum in ("bitti", "hata")
+
+    def calistir(self):
+        urun_resmi, prompt_text, kalite, yeni_varyasyon = self._girdi
+        self._girdi = None
+        self.durum = "çalışıyor"
+        try:
+            self.asama = "AI sahneni oluşturuyor"
+            with izle("studio_run", iz_id=self.iz_id, kaynak="tekil", islem="ai_sahne"):
+                self.sonuc = sahne_olustur(
+                    get_openai_client(), urun_resmi, prompt_text, kalite, yeni_varyasyon
+                )
+            if self.sonuc is None:
+                self.hata = (
+                    "AI görsel düzenlemesi başarısız oldu. "
+                    "Daha net bir açıklama yazarak tekrar deneyebilirsin."
+                )
+                self.durum = "hata"
+                return
+            self.durum = "bitti"
+        except Exception as e:
+            print("sahne işi hata:", e, traceback.format_exc())
+            self.hata = "Sonuç alınamadı. Lütfen tekrar dene."
+            self.durum = "hata"
+
+
+@st.cache_resource(show_spinner=False)
+def get_sahne_isleri() -> dict[str, SahneIsi]:
+    return {}
+
+
+def sahne_isi_baslat(
+    urun_resmi: Image.Image,
+    prompt_text: str,
+    kalite: str | None,
+    yeni_varyasyon: bool = False,
+    iz_id: str | None = None,
+    sahip: str = "",
+) -> str:
+    """AI sahne işini kuyruğa alır; aynı kullanıcının aynı girdiyle devam eden işi varsa onu döndürür."""
+    h = hashlib.sha256()
+    h.update(
+        f"{sahip}|{urun_resmi.mode}|{urun_resmi.size}|{prompt_text}|{kalite}|{yeni_varyasyon}".encode(
+            "utf-8"
+        )
+    )
+    h.update(urun_resmi.tobytes())
+    anahtar = h.hexdigest()
+
+    isler = get_sahne_isleri()
+    for is_ in list(isler.values()):
+        if is_.anahtar == anahtar and not is_.bitti:
+            return is_.id
+        if is_.bitti and time.time() - is_.olusturma > 3600:
+            isler.pop(is_.id, None)
+
+    yeni = SahneIsi(anahtar, urun_resmi.copy(), prompt_text, kalite, yeni_varyasyon, iz_id, sahip)
+    isler[yeni.id] = yeni
+    get_studio_executor().submit(yeni.calistir)
+    return yeni.id
+
+
+def aktif_sahne_isi() -> SahneIsi | None:
+    """Oturumdaki (ya da sayfa yenilendiyse URL'deki) AI sahne işini döndürür.
+
+    URL'deki id paylaşılabilir; iş yalnızca başlatan kullanıcıya (çerezdeki
+    kimlik) döndürülür, bağlantıyı açan başkası sonucu göremez.
+    """
+    is_id = st.session_state.get("sahne_is_id") or st.query_params.get("sahne_is")
+    is_ = get_sahne_isleri().get(is_id) if is_id else None
+    if is_ is not None and is_.sahip != kullanici_kimligi():
+        is_ = None
+    if is_ is None:
+        sahne_isini_birak()
+        return None
+    st.session_state.sahne_is_id = is_id
+    return is_
+
+
+def sahne_isini_birak():
+    st.session_state.sahne_is_id = None
+    if "sahne_is" in st.query_params:
+        del st.query_params["sahne_is"]
+
+
+def _sahne_isi_durumu():
+    is_ = get_sahne_isleri().get(st.session_state.get("sahne_is_id"))
+    if is_ is None:
+        sahne_isini_birak()
+        st.rerun()
+    if not is_.bitti:
+        gecen = time.time() - is_.olusturma
+        st.progress(min(gecen / 30.0, 0.95), text=f"{is_.asama}... ({gecen:.0f} sn) 🎨")
+        st.caption("Bu sırada sayfayı yenileyebilir veya mod değiştirebilirsin; işin kaybolmaz.")
+        return
+    if is_.sonuc is not None:
+        st.session_state.sonuc_gorseli = is_.sonuc
+        st.session_state.sonuc_format = "PNG"
+    else:
+        st.session_state.sahne_is_hata = is_.hata
+    # Sonuç artık oturumda; kayıt defterinde ikinci bir kopya tutulmasın.
+    get_sahne_isleri().pop(is_.id, None)
+    sahne_isini_birak()
+    st.rerun()
+
+
+def sahne_isi_paneli():
+    st.markdown(
+        '<div class="container-header">⏳ AI Sahne Oluşturuluyor</div>',
+        unsafe_allow_html=True,
+    )
+    st.fragment(_sahne_isi_durumu, run_every=1.0)()
+
+
+def sonuc_paneli():
+    st.markdown(
+        '<div class="container-header">✨ Sonuç</div>',
+        unsafe_allow_html=True,
+    )
+    with st.container():
+        st.markdown('<div class="image-container">', unsafe_allow_html=True)
+        st.image(st.session_state.sonuc_gorseli, width=350)
+        st.markdown("</div>", unsafe_allow_html=True)
+
+    c1, c2 = st.columns(2)
+    with c1:
+        with st.expander("👁️ Büyüt"):
+            st.image(st.session_state.sonuc_gorseli, use_container_width=True)
+    with c2:
+        st.download_button(
+            label=f"📥 İndir ({st.session_state.sonuc_format})",
+            data=st.session_state.sonuc_gorseli,
+            file_name=f"alptech_pro.{st.session_state.sonuc_format.lower()}",
+            mime=f"image/{st.session_state.sonuc_format.lower()}",
+            use_container_width=True,
+        )
+
+    st.write("")
+    if st.button("🔄 Yeni İşlem Yap"):
+        st.session_state.sonuc_gorseli = None
+        st.rerun()
+
+
+def _studyo_hazirlik():
+    """Görsel modelinin hazır olup olmadığını gösteren küçük rozet."""
+    isinma = get_studyo_isinmasi()
+    if isinma.hazir:
+        st.caption(f"🟢 Stüdyo hazır (model {isinma.sure:.1f} sn'de yüklendi)")
+    elif isinma.durum == "ısınıyor":
+        st.caption("🟡 Görsel modeli arka planda yükleniyor; ilk işlem biraz gecikebilir...")
+    elif isinma.durum == "hata":
+        st.caption("🔴 Görsel modeli önceden yüklenemedi; ilk işlemde yeniden denenecek.")
+    else:
+        st.caption("⚪ Görsel modeli ilk işlemde yüklenecek.")
+    if isinma.durum != "ısınıyor" and st.session_state.get("_isinma_izleniyor"):
+        # Isınma bitti: otomatik yenilemeyi durdurmak için sayfayı bir kez yenile.
+        st.session_state._isinma_izleniyor = False
+        st.rerun()
+    st.session_state._isinma_izleniyor = isinma.durum == "ısınıyor"
+
+
+def duzenleme_paneli(raw_image, iz_id: str | None = None):
+    """Sahne/preset seçimi ve işlem başlatma; seçim değiştikçe yalnızca bu panel yenilenir."""
+    st.markdown(
+        '<div class="container-header">✨ Düzenleme Modu</div>',
+        unsafe_allow_html=True,
+    )
+    hata = st.session_state.pop("sahne_is_hata", None)
+    if hata:
+        st.error(hata)
+
+    tab_hazir, tab_serbest = st.tabs(["🎨 Hazır Temalar / Preset", "✏️ Serbest Yazım"])
+    final_prompt = None
+    islem_tipi_local = None
+
+    with tab_hazir:
+        secilen_tema_input = st.selectbox(
+            "Ortam / preset seç:",
+            list(TEMA_LISTESI.keys()),
+            key="studio_tema",
+        )
+        if secilen_tema_input:
+            kod = TEMA_LISTESI[secilen_tema_input]
+            if isinstance(kod, str) and kod.startswith("ACTION_"):
+                islem_tipi_local = kod
+            else:
+                final_prompt = kod
+
+    with tab_serbest:
+        user_input = st.text_area(
+            "Hayalindeki sahneyi yaz:",
+            placeholder=(
+                "Örn: Arabanın rengini mavi yap, arkayı koyu gri degrade yap, "
+                "zeminde yumuşak yansıma olsun..."
+            ),
+            height=120,
+        )
+        if user_input:
+            final_prompt = (
+                "Professional product photography shot of the object. "
+                f"{user_input}. High quality, realistic lighting, 8k, photorealistic."
+            )
+
+    matte_kalitesi = kalite_secici("studio_quality")
+    yeni_varyasyon = st.checkbox(
+        "🎲 Yeni varyasyon üret",
+        key="studio_new_variation",
+        help="Aynı görsel ve sahne daha önce üretildiyse kayıtlı sonuç anında gelir. "
+        "İşaretlersen yeni bir AI üretimi yapılır.",
+    )
+
+    st.write("")
+    buton_placeholder = st.empty()
+    if buton_placeholder.button("🚀 İşlemi Başlat", type="primary"):
+        inc_stat("studio_runs")
+        try:
+            if final_prompt and SABIT_API_KEY is not None:
+                is_id = sahne_isi_baslat(
+                    raw_image,
+                    final_prompt,
+                    matte_kalitesi,
+                    yeni_varyasyon,
+                    iz_id,
+                    kullanici_kimligi(),
+                )
+                st.session_state.sahne_is_id = is_id
+                st.query_params["sahne_is"] = is_id
+                st.rerun()
+            elif islem_tipi_local:
+                with st.spinner("Hızlı işleniyor..."):
+                    with izle("studio_run", iz_id=iz_id, kaynak="tekil", islem=islem_tipi_local):
+                        sonuc = yerel_islem(raw_image, islem_tipi_local, matte_kalitesi)
+                        veri, fmt = sonuc_kodla(sonuc, islem_tipi_local)
+                    st.session_state.sonuc_gorseli = veri
+                    st.session_state.sonuc_format = fmt
+                    st.rerun()
+            else:
+                st.warning("Lütfen bir hazır tema seç veya kendi sahneni yaz.")
+        except Exception as e:
+            st.error(f"Hata: {e}")
+            print("İşlem başlat hata:", traceback.format_exc())
+            buton_placeholder.button("🚀 Tekrar Dene", type="primary")
+
+
+# ===========================
+# SOHBET ARAYÜZÜ (FRAGMENT'LAR)
+# ===========================
+def _sohbet_ek_paneli():
+    """'+' ile açılan görsel/belge yükleme paneli ve ek bilgisi."""
+    top_bar = st.container()
+    with top_bar:
+        col_plus, col_info = st.columns([0.12, 0.88])
+        with col_plus:
+            if st.button("➕", key="chat_plus", help="Dosya / görsel ekle"):
+                st.session_state.show_upload_panel = (
+                    not st.session_state.show_upload_panel
+                )
+        with col_info:
+            if st.session_state.chat_image:
+                gorsel = st.session_state.chat_image
+                st.caption(
+                    "📎 Bir ürün görseli eklendi. Yeni sorularında bu görsele göre açıklama isteyebilirsin. "
+                    f"({gorsel['boyut'][0]}×{gorsel['boyut'][1]}, {gorsel['bayt'] // 1024} KB, "
+                    f"{CHAT_IMAGE_DETAILS[gorsel['detail']].split(' (')[0].lower()} ayrıntı)"
+                )
+            else:
+                st.caption(
+                    "İstersen '+' ile ürün görseli ekleyip mağaza açıklaması, kampanya metni vb. yazdırabilirsin."
+                )
+            dizin = st.session_state.get("belge_dizini")
+            if dizin is not None and dizin.parcalar:
+                dosyalar = sorted({p["dosya"] for p in dizin.parcalar})
+                st.caption(f"📚 {len(dosyalar)} belge ({len(dizin.parcalar)} bölüm): " + ", ".join(dosyalar))
+
+    if st.session_state.show_upload_panel:
+        with st.expander("📎 Dosya / Görsel yükle", expanded=True):
+            gorsel_detayi = st.selectbox(
+                "Görsel ayrıntı düzeyi",
+                list(CHAT_IMAGE_DETAILS),
+                index=list(CHAT_IMAGE_DETAILS).index(CHAT_IMAGE_DETAIL),
+                format_func=CHAT_IMAGE_DETAILS.get,
+                key="chat_image_detail",
+                help="Düşük ayrıntı daha hızlı ve ucuzdur; küçük yazıları okumak için yüksek seç.",
+            )
+            chat_upload = st.file_uploader(
+                "Görsel veya dosya yükle",
+                type=["png", "jpg", "jpeg", "webp", "pdf", "txt"],
+                key="chat_upload",
+            )
+            if chat_upload is not None:
+                try:
+                    file_bytes = chat_upload.read()
+                    if chat_upload.name.lower().endswith((".pdf", ".txt")):
+                        if "belge_dizini" not in st.session_state:
+                            st.session_state.belge_dizini = BM25Dizin()
+                        durum = st.empty()
+                        eklenen = belge_yukle(
+                            chat_upload.name,
+                            file_bytes,
+                            lambda sayfa: durum.caption(f"📄 Sayfa {sayfa} işleniyor..."),
+                        )
+                        durum.empty()
+                        if eklenen:
+                            st.success(
+                                f"Belge işlendi ({eklenen} bölüm). Sorularında ilgili kısımlar otomatik kullanılacak."
+                            )
+                        elif belge_ozeti(file_bytes) in st.session_state.belge_dizini.ozetler:
+                            st.info(f"{chat_upload.name} zaten ekli; sorularında kullanılmaya devam ediyor.")
+                        else:
+                            st.warning("Belgede okunabilir metin bulunamadı.")
+                    else:
+                        st.session_state.chat_image = sohbet_gorseli_hazirla(file_bytes, gorsel_detayi)
+                        st.success("Dosya yüklendi. Şimdi bu dosya/görsel hakkında soru sorabilirsin.")
+                    st.session_state.show_upload_panel = False
+                    inc_stat("uploads")
+                except Exception as e:
+                    st.error("Dosya okunamadı, lütfen tekrar dene.")
+                    print("chat upload error:", e)
+
+
+def _sohbet_dokumu():
+    """Konuşmanın yalnızca son CHAT_WINDOW mesajını çizer; eskiler istenince açılır."""
+    gecmis = st.session_state.chat_history
+    pencere = st.session_state.get("sohbet_penceresi", CHAT_WINDOW)
+    daha_eski = len(gecmis) > pencere or (gecmis and gecmis[0]["sira"] > 0)
+    if daha_eski and st.button("⬆ Daha eski mesajlar", key="chat_older"):
+        pencere += CHAT_WINDOW
+        if pencere > len(gecmis):
+            eski_mesajlari_yukle()
+        st.session_state.sohbet_penceresi = pencere
+    for msg in gecmis[-pencere:]:
+        with st.chat_message(msg["role"]):
+            st.write(msg["content"])
+
+
 # ===========================
 # SIDEBAR (KONUŞMA GEÇMİŞİ & PROMPT KÜTÜPHANESİ)
 # ===========================
+def bakim_paneli():
+    """Yönetici araçları (ADMIN_TOOLS açıkken): benchmark ve teşhis."""
+    with st.expander("🛠 Bakım", expanded=False):
+        st.markdown("**Rerun profili** (bölüm başına duvar saati)")
+        profil = get_rerun_profili()
+        if st.button("↺ Profili sıfırla", key="bench_profile_reset"):
+            profil.sifirla()
+        satirlar = profil.ozet()
+        if satirlar:
+            st.dataframe(satirlar, hide_index=True, use_container_width=True)
+        else:
+            st.caption("Henüz ölçüm yok.")
+
+        st.markdown("**Aşama izleri**")
+        if get_metrik_sunucusu() is not None:
+            st.caption(f"Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        if TRACE_LOG_PATH:
+            st.caption(f"JSON günlük: {TRACE_LOG_PATH}")
+
+        st.markdown("**Matting benchmark**")
+        ornek = st.file_uploader(
+            "Örnek ürün görseli",
+            type=["png", "jpg", "jpeg", "webp"],
+            key="bench_matte_upload",
+        )
+        if ornek is not None and st.button("⏱ Kalite seviyelerini ölç", key="bench_matte_run"):
+            resim = gorsel_ac(ornek)
+            with st.spinner("Ölçülüyor..."):
+                st.table(matte_benchmark(resim))
+
+        st.markdown("**Şehir ayrıştırma örnekleri**")
+        if st.button("▶ Örnekleri çalıştır", key="bench_city_run"):
+            satirlar = sehir_ayristirma_kontrolu()
+            hatali = sum(not s["ok"] for s in satirlar)
+            (st.error if hatali else st.success)(f"{len(satirlar) - hatali}/{len(satirlar)} doğru")
+            st.table(satirlar)
+
+        st.markdown("**Moderasyon benchmark**")
+        if st.button("⏱ Filtre verimini ölç", key="bench_mod_run"):
+            with st.spinner("Ölçülüyor..."):
+                st.table(moderasyon_benchmark())
+
+
 def sidebar_ui():
-    st.sidebar.markdown("### 🧠 ALPTECH AI Panel")
-
-    # Konuşma geçmişi
-    st.sidebar.markdown("**Konuşmalarım**")
-    sessions = list(st.session_state.chat_sessions.keys())
-    if st.sidebar.button("➕ Yeni konuşma"):
-        new_name = f"Oturum {len(sessions) + 1}"
-        st.session_state.chat_sessions[new_name] = [
-            {
-                "role": "assistant",
-                "content": "Yeni bir konuşma başlattın. Neye odaklanmak istersin?",
-            }
-        ]
-        st.session_state.current_session = new_name
-        st.session_state.chat_history = st.session_state.chat_sessions[new_name]
-        st.experimental_rerun()
-
-    sessions = list(st.session_state.chat_sessions.keys())
-    if sessions:
-        selected = st.sidebar.selectbox(
-            "Aktif konuşma", sessions, index=sessions.index(st.session_state.current_session)
+    """Sidebar içeriği; `with st.sidebar:` altında kendi fragment'ında çalışır."""
+    st.markdown("### 🧠 ALPTECH AI Panel")
+
+    # Konuşma geçmişi (depodan yalnızca üst veri okunur)
+    st.markdown("**Konuşmalarım**")
+    depo = get_sohbet_deposu()
+    kullanici = st.session_state.sohbet_kullanici
+    oturumlar = depo.oturumlar(kullanici)
+    if st.button("➕ Yeni konuşma"):
+        yeni_oturum(
+            f"Oturum {len(oturumlar) + 1}",
+            "Yeni bir konuşma başlattın. Neye odaklanmak istersin?",
         )
-        if selected != st.session_state.current_session:
-            st.session_state.chat_sessions[st.session_state.current_session] = (
-                st.session_state.chat_history
-            )
-            st.session_state.current_session = selected
-            st.session_state.chat_history = st.session_state.chat_sessions[selected]
-            st.experimental_rerun()
+        st.rerun()
+
+    adlar = {o["id"]: f"{o['ad']} ({o['mesaj_sayisi']})" for o in oturumlar}
+    aktif = st.session_state.current_session
+    if aktif not in adlar:
+        adlar[aktif] = (depo.oturum(aktif) or {}).get("ad", "Oturum")
+    secenekler = list(adlar)
+    selected = st.selectbox(
+        "Aktif konuşma", secenekler, index=secenekler.index(aktif), format_func=adlar.get
+    )
+    if selected != aktif:
+        oturum_ac(selected)
+        st.rerun()
+
+    arama = st.text_input("🔎 Konuşmalarda ara", key="sohbet_arama")
+    if arama.strip():
+        sonuclar = depo.ara(kullanici, arama)
+        if not sonuclar:
+            st.caption("Eşleşme bulunamadı.")
+        for i, sonuc in enumerate(sonuclar):
+            if st.button(f"{sonuc['ad']}: {sonuc['parca']}", key=f"sohbet_arama_{i}"):
+                oturum_ac(sonuc["oturum"])
+                st.session_state.app_mode = "💬 Sohbet Modu (Genel Asistan)"
+                st.rerun()
 
-    st.sidebar.markdown("---")
+    st.markdown("---")
 
     # Prompt kütüphanesi
-    st.sidebar.markdown("**Hazır Promptlar**")
-    prompt_exp = st.sidebar.expander("Metin & Kampanya", expanded=False)
+    st.markdown("**Hazır Promptlar**")
+    st.toggle(
+        "⚡ Tekrarlanan sorularda önbellekten yanıtla",
+        value=True,
+        key="llm_onbellek",
+        help="Aynı soru daha önce aynı bağlamda sorulduysa kayıtlı yanıt anında gösterilir.",
+    )
+    onceki_prompt = st.session_state.pending_prompt
+    prompt_exp = st.expander("Metin & Kampanya", expanded=False)
     with prompt_exp:
         if st.button("🛍 Ürün açıklaması oluştur", key="p_prod_desc"):
             st.session_state.pending_prompt = (
@@ -852,7 +4278,7 @@ def sidebar_ui():
                 "Konu: [EĞİTİM KONUSU], Tarih: [TARİH], Hedef kitle: [HEDEF]."
             )
 
-    prompt_img = st.sidebar.expander("Görsel & Tasarım", expanded=False)
+    prompt_img = st.expander("Görsel & Tasarım", expanded=False)
     with prompt_img:
         if st.button("📲 Instagram post tasarım fikri", key="p_ig_post"):
             st.session_state.pending_prompt = (
@@ -865,19 +4291,49 @@ def sidebar_ui():
                 "Her fikirde hedef kitle, mesaj ve görsel tarzı belirt."
             )
 
-    st.sidebar.markdown("---")
+    if st.session_state.pending_prompt != onceki_prompt:
+        # Hazır prompt sohbet akışında işlenir: tüm sayfa yeniden çalışmalı.
+        st.rerun()
+
+    st.markdown("---")
 
     # Analytics
-    with st.sidebar.expander("📊 Analytics (demo)", expanded=False):
+    with st.expander("📊 Analytics (demo)", expanded=False):
         a = st.session_state.analytics
         st.write(f"Stüdyo çalıştırma: {a.get('studio_runs', 0)}")
         st.write(f"Sohbet mesajı: {a.get('chat_messages', 0)}")
+        if "ilk_token_ms" in a:
+            st.write(f"İlk token süresi (son yanıt): {a['ilk_token_ms']} ms")
         st.write(f"Hava durumu sorgusu: {a.get('weather_queries', 0)}")
         st.write(f"7 günlük tahmin sorgusu: {a.get('forecast_queries', 0)}")
+        yc = yanit_onbellegi()
+        if yc is not None:
+            st.write(
+                f"Yanıt önbelleği: {yc.isabet} isabet / {yc.iska} ıska, "
+                f"{yc.toplam_bayt / (1024 * 1024):.1f} MB"
+            )
+        hc = get_hava_onbellegi()
+        st.write(
+            f"Hava önbelleği: {hc.isabet} isabet / {hc.iska} ıska / {hc.birlesen} birleşen"
+        )
         st.write(f"Yüklenen dosya/görsel: {a.get('uploads', 0)}")
+        sc = sahne_onbellegi()
+        if sc is not None:
+            st.write(
+                f"Sahne önbelleği: {sc.isabet} isabet / {sc.iska} ıska, "
+                f"{sc.toplam_bayt / (1024 * 1024):.1f} MB"
+            )
+        mc = get_matte_cache()
+        st.write(
+            f"Matte önbellek: {mc.hits} isabet / {mc.misses} ıska, "
+            f"{mc.current_bytes / (1024 * 1024):.1f} MB"
+        )
+
+    if ADMIN_TOOLS:
+        bakim_paneli()
 
-    st.sidebar.markdown("---")
-    st.sidebar.markdown(
+    st.markdown("---")
+    st.markdown(
         "**Hakkında**\n\n"
         "Bu platform, ALPTECH AI ekibi tarafından geliştirilmiş bir yapay zeka stüdyosudur. "
         "Ürün görsellerini profesyonel seviyeye taşımak ve içerik üretim sürecini hızlandırmak için tasarlandı. 🚀"
@@ -886,15 +4342,33 @@ def sidebar_ui():
 # ===========================
 # HEADER & GENEL UI
 # ===========================
+# Her tam rerun bölüm bölüm ölçülür (bkz. Bakım > Rerun profili); fragment
+# rerun'ları profilli() ile ayrıca yazılır.
+zamanlayici = RerunZamanlayici(_RERUN_BASLANGIC)
+zamanlayici.isaret("kurulum (tanımlar)")
+
 # Tema seçimi
 col_bosluk, col_tema = st.columns([10, 1])
 with col_tema:
     karanlik_mod = st.toggle("🌙 / ☀️", value=True, key="theme_toggle")
 tema = get_theme(karanlik_mod)
 apply_apple_css(tema)
+zamanlayici.isaret("tema & CSS")
+
+# Arka plan servisleri (process başına bir kez başlar)
+get_saat_senkronu()
+get_hava_onyukleyici()
+get_studyo_isinmasi()
+get_metrik_sunucusu()
+
+# Sohbet deposu: kullanıcının son konuşması
+sohbet_oturumunu_hazirla()
+zamanlayici.isaret("servisler & oturum")
 
-# Sidebar UI
-sidebar_ui()
+# Sidebar UI: kendi fragment'ında; sidebar tıklamaları ana sayfayı yeniden çizmez.
+with st.sidebar:
+    st.fragment(profilli("sidebar", sidebar_ui))()
+zamanlayici.isaret("sidebar")
 
 # Header
 header_left, header_right = st.columns([0.16, 0.84])
@@ -944,6 +4418,7 @@ with col_chat:
 
 
 st.divider()
+zamanlayici.isaret("header & mod seçimi")
 
 # ===========================
 # STÜDYO MODU
@@ -990,22 +4465,34 @@ if st.session_state.app_mode == "📸 Stüdyo Modu (Görsel Düzenleme)":
             unsafe_allow_html=True,
         )
 
-    st.markdown("#### Ürün görselini yükle")
-    uploaded_file = st.file_uploader(
-        "Ürün fotoğrafı",
-        type=["png", "jpg", "jpeg", "webp"],
-        label_visibility="collapsed",
-        key="studio_upload",
-    )
+    isinma = get_studyo_isinmasi()
+    st.fragment(_studyo_hazirlik, run_every=2.0 if isinma.durum == "ısınıyor" else None)()
+
+    toplu_mod = st.toggle("📚 Toplu mod (çoklu ürün / katalog)", key="studio_batch_mode")
+    if toplu_mod:
+        toplu_studyo_ui()
+        uploaded_file = None
+    else:
+        st.markdown("#### Ürün görselini yükle")
+        uploaded_file = st.file_uploader(
+            "Ürün fotoğrafı",
+            type=["png", "jpg", "jpeg", "webp"],
+            label_visibility="collapsed",
+            key="studio_upload",
+        )
 
     kaynak_dosya = uploaded_file
+    aktif_is = aktif_sahne_isi()
 
     if kaynak_dosya:
         col_orijinal, col_sag_panel = st.columns([1, 1], gap="medium")
 
+        # Açma bu rerun'da, işleme butonla sonraki rerun'da (ya da arka plan işinde)
+        # olur; ikisi yüklemeye bağlı aynı iz_id altında toplanır.
+        yukleme_iz_id = yukleme_iz_kimligi(kaynak_dosya)
         try:
-            raw_image = Image.open(kaynak_dosya)
-            raw_image = ImageOps.exif_transpose(raw_image).convert("RGBA")
+            with izle("studio_upload", iz_id=yukleme_iz_id):
+                raw_image = gorsel_ac(kaynak_dosya)
         except Exception as e:
             st.error("Görsel açılamadı. Lütfen farklı bir dosya deneyin.")
             print("image open error:", e, traceback.format_exc())
@@ -1023,163 +4510,20 @@ if st.session_state.app_mode == "📸 Stüdyo Modu (Görsel Düzenleme)":
                     st.markdown("</div>", unsafe_allow_html=True)
 
             with col_sag_panel:
-                if st.session_state.sonuc_gorseli is None:
-                    st.markdown(
-                        '<div class="container-header">✨ Düzenleme Modu</div>',
-                        unsafe_allow_html=True,
-                    )
-
-                    tab_hazir, tab_serbest = st.tabs(
-                        ["🎨 Hazır Temalar / Preset", "✏️ Serbest Yazım"]
+                if aktif_is is not None:
+                    sahne_isi_paneli()
+                elif st.session_state.sonuc_gorseli is None:
+                    st.fragment(profilli("düzenleme", duzenleme_paneli))(
+                        raw_image, yukleme_iz_id
                     )
-                    final_prompt = None
-                    islem_tipi_local = None
-
-                    with tab_hazir:
-                        secilen_tema_input = st.selectbox(
-                            "Ortam / preset seç:",
-                            list(TEMA_LISTESI.keys()),
-                            key="studio_tema",
-                        )
-                        if secilen_tema_input:
-                            kod = TEMA_LISTESI[secilen_tema_input]
-                            if isinstance(kod, str) and kod.startswith("ACTION_"):
-                                islem_tipi_local = kod
-                            else:
-                                final_prompt = kod
-
-                    with tab_serbest:
-                        user_input = st.text_area(
-                            "Hayalindeki sahneyi yaz:",
-                            placeholder=(
-                                "Örn: Arabanın rengini mavi yap, arkayı koyu gri degrade yap, "
-                                "zeminde yumuşak yansıma olsun..."
-                            ),
-                            height=120,
-                        )
-                        if user_input:
-                            final_prompt = (
-                                "Professional product photography shot of the object. "
-                                f"{user_input}. High quality, realistic lighting, 8k, photorealistic."
-                            )
-
-                    st.write("")
-                    buton_placeholder = st.empty()
-                    if buton_placeholder.button("🚀 İşlemi Başlat", type="primary"):
-                        inc_stat("studio_runs")
-                        try:
-                            if final_prompt and SABIT_API_KEY is not None:
-                                client = OpenAI(api_key=SABIT_API_KEY)
-                                with st.spinner(
-                                    "AI sahneni oluşturuyor (10–30sn)... 🎨"
-                                ):
-                                    url = sahne_olustur(
-                                        client, raw_image, final_prompt
-                                    )
-                                    if url:
-                                        try:
-                                            resp = requests.get(url, timeout=40)
-                                            if resp.status_code == 200:
-                                                st.session_state.sonuc_gorseli = (
-                                                    resp.content
-                                                )
-                                                st.session_state.sonuc_format = "PNG"
-                                                st.experimental_rerun()
-                                            else:
-                                                st.error(
-                                                    "AI görseli indirilemedi. Lütfen tekrar dene."
-                                                )
-                                        except Exception as e:
-                                            st.error(
-                                                "Sonuç indirilemedi. Lütfen tekrar dene."
-                                            )
-                                            print(
-                                                "resim indir hata:",
-                                                e,
-                                                traceback.format_exc(),
-                                            )
-                                    else:
-                                        st.error(
-                                            "AI görsel düzenlemesi başarısız oldu. "
-                                            "Daha net bir açıklama yazarak tekrar deneyebilirsin."
-                                        )
-                            elif islem_tipi_local:
-                                with st.spinner("Hızlı işleniyor..."):
-                                    sonuc = yerel_islem(raw_image, islem_tipi_local)
-                                    buf = BytesIO()
-                                    fmt = (
-                                        "PNG"
-                                        if islem_tipi_local == "ACTION_TRANSPARENT"
-                                        else "JPEG"
-                                    )
-                                    sonuc.save(buf, format=fmt)
-                                    st.session_state.sonuc_gorseli = buf.getvalue()
-                                    st.session_state.sonuc_format = fmt
-                                    st.experimental_rerun()
-                            else:
-                                st.warning(
-                                    "Lütfen bir hazır tema seç veya kendi sahneni yaz."
-                                )
-                        except Exception as e:
-                            st.error(f"Hata: {e}")
-                            print("İşlem başlat hata:", traceback.format_exc())
-                            buton_placeholder.button(
-                                "🚀 Tekrar Dene", type="primary"
-                            )
                 else:
-                    st.markdown(
-                        '<div class="container-header">✨ Sonuç</div>',
-                        unsafe_allow_html=True,
-                    )
-                    with st.container():
-                        st.markdown('<div class="image-container">', unsafe_allow_html=True)
-                        st.image(st.session_state.sonuc_gorseli, width=350)
-                        st.markdown("</div>", unsafe_allow_html=True)
-
-                    c1, c2 = st.columns(2)
-                    with c1:
-                        with st.expander("👁️ Büyüt"):
-                            st.image(
-                                st.session_state.sonuc_gorseli, use_container_width=True
-                            )
-                    with c2:
-                        if isinstance(
-                            st.session_state.sonuc_gorseli, (bytes, bytearray)
-                        ):
-                            st.download_button(
-                                label=f"📥 İndir ({st.session_state.sonuc_format})",
-                                data=st.session_state.sonuc_gorseli,
-                                file_name=f"alptech_pro.{st.session_state.sonuc_format.lower()}",
-                                mime=f"image/{st.session_state.sonuc_format.lower()}",
-                                use_container_width=True,
-                            )
-                        else:
-                            try:
-                                resp = requests.get(
-                                    st.session_state.sonuc_gorseli, timeout=30
-                                )
-                                if resp.status_code == 200:
-                                    st.download_button(
-                                        label="📥 İndir (PNG)",
-                                        data=resp.content,
-                                        file_name="alptech_pro.png",
-                                        mime="image/png",
-                                        use_container_width=True,
-                                    )
-                                else:
-                                    st.warning("İndirilebilir sonuç bulunamadı.")
-                            except Exception as e:
-                                st.warning("İndirilebilir sonuç alınamadı.")
-                                print(
-                                    "download fallback hata:",
-                                    e,
-                                    traceback.format_exc(),
-                                )
-
-                    st.write("")
-                    if st.button("🔄 Yeni İşlem Yap"):
-                        st.session_state.sonuc_gorseli = None
-                        st.experimental_rerun()
+                    st.fragment(profilli("sonuç", sonuc_paneli))()
+
+    elif aktif_is is not None:
+        sahne_isi_paneli()
+    elif st.session_state.sonuc_gorseli is not None and not toplu_mod:
+        st.fragment(profilli("sonuç", sonuc_paneli))()
+    zamanlayici.isaret("stüdyo")
 
 # ===========================
 # SOHBET MODU
@@ -1192,47 +4536,11 @@ elif st.session_state.app_mode == "💬 Sohbet Modu (Genel Asistan)":
         unsafe_allow_html=True,
     )
 
-    # Chat içi '+' ile upload panel yönetimi
-    top_bar = st.container()
-    with top_bar:
-        col_plus, col_info = st.columns([0.12, 0.88])
-        with col_plus:
-            if st.button("➕", key="chat_plus", help="Dosya / görsel ekle"):
-                st.session_state.show_upload_panel = (
-                    not st.session_state.show_upload_panel
-                )
-        with col_info:
-            if st.session_state.chat_image:
-                st.caption(
-                    "📎 Bir ürün görseli eklendi. Yeni sorularında bu görsele göre açıklama isteyebilirsin."
-                )
-            else:
-                st.caption(
-                    "İstersen '+' ile ürün görseli ekleyip mağaza açıklaması, kampanya metni vb. yazdırabilirsin."
-                )
-
-    if st.session_state.show_upload_panel:
-        with st.expander("📎 Dosya / Görsel yükle", expanded=True):
-            chat_upload = st.file_uploader(
-                "Görsel veya dosya yükle",
-                type=["png", "jpg", "jpeg", "webp", "pdf", "txt"],
-                key="chat_upload",
-            )
-            if chat_upload is not None:
-                try:
-                    file_bytes = chat_upload.read()
-                    st.session_state.chat_image = file_bytes
-                    st.session_state.show_upload_panel = False
-                    inc_stat("uploads")
-                    st.success("Dosya yüklendi. Şimdi bu dosya/görsel hakkında soru sorabilirsin.")
-                except Exception as e:
-                    st.error("Dosya okunamadı, lütfen tekrar dene.")
-                    print("chat upload error:", e)
-
-    # Mesaj geçmişini göster
-    for msg in st.session_state.chat_history:
-        with st.chat_message(msg["role"]):
-            st.write(msg["content"])
+    # Ek paneli ve konuşma dökümü ayrı fragment'larda: birindeki tıklama
+    # diğerini (ve tüm sayfayı) yeniden çizmez.
+    st.fragment(profilli("sohbet ekleri", _sohbet_ek_paneli))()
+    st.fragment(profilli("sohbet dökümü", _sohbet_dokumu))()
+    zamanlayici.isaret("sohbet dökümü")
 
     # Pending prompt (sidebar hazır prompt)
     pending_prompt = st.session_state.pending_prompt
@@ -1243,33 +4551,25 @@ elif st.session_state.app_mode == "💬 Sohbet Modu (Genel Asistan)":
     prompt = pending_prompt or chat_input_value
 
     if prompt:
-        inc_stat("chat_messages")
-        st.session_state.chat_history.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.write(prompt)
-
-        # Güvenlik filtresi
-        mod_msg = moderate_content(prompt)
-        if mod_msg is not None:
-            with st.chat_message("assistant"):
-                st.write(mod_msg)
-            st.session_state.chat_history.append({"role": "assistant", "content": mod_msg})
-        else:
-            override = custom_identity_interceptor(prompt)
-            if override is not None:
+        # Turdaki tüm dış çağrılar (saat, hava, LLM) tek bir süre bütçesini paylaşır.
+        with tur_butcesi(CHAT_TURN_BUDGET):
+            inc_stat("chat_messages")
+            mesaj_ekle("user", prompt)
+            with st.chat_message("user"):
+                st.write(prompt)
+
+            # Güvenlik filtresi
+            mod_msg = moderate_content(prompt)
+            if mod_msg is not None:
                 with st.chat_message("assistant"):
-                    st.write(override)
-                st.session_state.chat_history.append(
-                    {"role": "assistant", "content": override}
-                )
+                    st.write(mod_msg)
+                mesaj_ekle("assistant", mod_msg)
             else:
-                util_override = custom_utility_interceptor(prompt)
-                if util_override is not None:
+                override = niyet_yaniti(prompt)
+                if override is not None:
                     with st.chat_message("assistant"):
-                        st.write(util_override)
-                    st.session_state.chat_history.append(
-                        {"role": "assistant", "content": util_override}
-                    )
+                        st.write(override)
+                    mesaj_ekle("assistant", override)
                 else:
                     if SABIT_API_KEY is None:
                         cevap = (
@@ -1278,23 +4578,11 @@ elif st.session_state.app_mode == "💬 Sohbet Modu (Genel Asistan)":
                         )
                         with st.chat_message("assistant"):
                             st.write(cevap)
-                        st.session_state.chat_history.append(
-                            {"role": "assistant", "content": cevap}
-                        )
+                        mesaj_ekle("assistant", cevap)
                     else:
                         with st.chat_message("assistant"):
-                            with st.spinner("ALPTECH yazıyor..."):
-                                client = OpenAI(api_key=SABIT_API_KEY)
-                                cevap = normal_sohbet(client)
-                                st.write(cevap)
-                                st.session_state.chat_history.append(
-                                    {"role": "assistant", "content": cevap}
-                                )
-
-    # Güncel chat'i aktif oturuma kaydet
-    st.session_state.chat_sessions[st.session_state.current_session] = (
-        st.session_state.chat_history
-    )
+                            sohbet_yanitini_yaz(get_openai_client())
+        zamanlayici.isaret("sohbet turu")
 
 # ===========================
 # FOOTER
@@ -1303,5 +4591,7 @@ st.markdown(
     "<div class='custom-footer'>ALPTECH AI Stüdyo © 2025 | Developed by Alper</div>",
     unsafe_allow_html=True,
 )
+zamanlayici.isaret("footer")
+zamanlayici.bitir()
 
 